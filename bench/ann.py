@@ -0,0 +1,118 @@
+"""向量索引基准：在不同语料规模下比较 flat / hnsw / ivfpq 以及 float32 / fp16 / sq8 存储的
+召回率、检索延迟、内存占用与构建耗时
+
+召回率以 IndexFlatL2 精确检索的 top-k 为基准计算 recall@k，内存折算为每1万个知识块的MB数。
+“删后自检”按知识库的方式删除一部分向量（支持删除的直接删，hnsw在检索时排除）再追加新向量，
+统计保留向量和新向量以自身为查询时top-1命中自己的比例，删除的向量出现在结果里直接报错。
+向量为带聚类结构、已归一化的随机向量，比各维独立的随机向量更接近真实文本向量的分布；
+归一化后L2与内积的排序一致，压缩存储的召回损失只来自量化本身。
+
+在项目根目录运行：
+    uv run python -m bench.ann --sizes 10000 50000 200000 --queries 200 --k 10
+    uv run python -m bench.ann --sizes 10000 --kinds flat --storages float32 fp16 sq8 --rerank
+"""
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from rag.index import normalize, exact_rank, index_kind, build_index, is_normalized, search_params, supports_remove
+
+EMBEDDING_DIM = 768
+LATENT_DIM = 64
+REMOVE_CHECK_SIZE = 20_000  # 删后自检最多用的向量数
+REMOVE_CHECK_QUERIES = 100
+
+
+def make_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """生成n个围绕若干中心分布、内在维度较低（64维投影到dim维）的向量"""
+    rng = np.random.default_rng(seed)
+    latent_rng = np.random.default_rng(0)  # 语料与查询共用同一组中心和投影
+    centers = latent_rng.normal(0, 1, (64, LATENT_DIM))
+    projection = latent_rng.normal(0, 1, (LATENT_DIM, dim))
+    latent = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 0.5, (n, LATENT_DIM))
+    return normalize(latent @ projection + rng.normal(0, 0.1, (n, dim)))
+
+
+def bench_kind(kind: str, storage: str, rerank: int, vectors: np.ndarray, queries: np.ndarray,
+               truth: np.ndarray, k: int) -> dict:
+    begin = time.perf_counter()
+    index = build_index(vectors, np.arange(len(vectors), dtype=np.int64), kind, storage)
+    build_s = time.perf_counter() - begin
+
+    costs = []
+    found = []
+    normalized = is_normalized(index)
+    for query in queries:  # 线上每次检索一条查询，逐条计时
+        begin = time.perf_counter()
+        _, I = index.search(query[None], k * rerank if rerank else k)
+        if rerank:  # 与知识库一致：多取候选，再用原始向量精确重排
+            I = exact_rank(query[None], I[0][I[0] >= 0], vectors, normalized)[:, :k]
+        costs.append((time.perf_counter() - begin) * 1000)
+        found.append(I[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return {
+        "build_s": build_s,
+        "p50_ms": float(np.percentile(costs, 50)),
+        "p95_ms": float(np.percentile(costs, 95)),
+        "recall": float(recall),
+        "memory_mb": faiss.serialize_index(index).nbytes / 2 ** 20 * 10_000 / len(vectors),
+    }
+
+
+def check_remove(kind: str, storage: str, vectors: np.ndarray) -> float:
+    """删除1%的向量、追加同样多的新向量后，保留向量和新向量的top-1自检命中率"""
+    n = min(len(vectors), REMOVE_CHECK_SIZE)
+    ids = np.arange(n, dtype=np.int64)
+    index = build_index(vectors[:n], ids, kind, storage)
+    removed = ids[::100]
+    params = None
+    if supports_remove(index):
+        index.remove_ids(removed)
+    else:
+        params = search_params(index, removed, exclude=True)
+    added = make_vectors(len(removed), EMBEDDING_DIM, seed=2)
+    added_ids = np.arange(n, n + len(added), dtype=np.int64)
+    index.add_with_ids(normalize(added) if is_normalized(index) else added, added_ids)
+
+    kept = np.setdiff1d(ids, removed)[:REMOVE_CHECK_QUERIES]
+    probe_ids = np.concatenate([kept, added_ids])
+    probes = np.concatenate([vectors[kept], added])
+    _, I = index.search(normalize(probes) if is_normalized(index) else probes, 10, params=params)
+    if np.isin(I, removed).any():
+        raise AssertionError(f"{kind}/{storage}: 删除的向量仍出现在检索结果里")
+    return float(np.mean(I[:, 0] == probe_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量索引基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000], help="语料规模")
+    parser.add_argument("--queries", type=int, default=200, help="查询条数")
+    parser.add_argument("--k", type=int, default=10, help="recall@k中的k")
+    parser.add_argument("--kinds", nargs="+", default=["flat", "hnsw", "ivfpq"], help="参与比较的索引类型")
+    parser.add_argument("--storages", nargs="+", default=["float32"], help="参与比较的向量存储方式")
+    parser.add_argument("--rerank", type=int, nargs="?", const=4, default=0,
+                        help="压缩存储时取k的几倍候选用原始向量精确重排，不带该参数则不重排")
+    args = parser.parse_args()
+
+    print(f"{'规模':>8} {'类型':>6} {'存储':>8} {'构建(s)':>8} {'p50(ms)':>8} {'p95(ms)':>8} "
+          f"{'recall@' + str(args.k):>10} {'MB/万块':>8} {'删后自检':>8}  自动选择")
+    for n in args.sizes:
+        vectors = make_vectors(n, EMBEDDING_DIM)
+        queries = make_vectors(args.queries, EMBEDDING_DIM, seed=1)
+        exact = faiss.IndexFlatL2(EMBEDDING_DIM)
+        exact.add(vectors)
+        _, truth = exact.search(queries, args.k)
+        for kind in args.kinds:
+            for storage in args.storages:
+                rerank = args.rerank if storage != "float32" else 0
+                r = bench_kind(kind, storage, rerank, vectors, queries, truth, args.k)
+                self_hit = check_remove(kind, storage, vectors)
+                mark = "*" if kind == index_kind(n) else ""
+                print(f"{n:>8} {kind:>6} {storage:>8} {r['build_s']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                      f"{r['recall']:>10.3f} {r['memory_mb']:>8.1f} {self_hit:>8.2f}  {mark}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""基准测试用的本地假服务：tushare数据接口与硅基流动（embedding、流式对话）接口，可配置延迟"""
+import json
+import time
+import zlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from tools.trade_calendar import get_trading_calendar
+
+EMBEDDING_DIM = 768
+
+
+class FakeServer:
+    """在后台线程运行的HTTP服务，latency为每个请求的固定延迟（秒）"""
+
+    def __init__(self, handler_cls, latency: float = 0.0):
+        handler = type(handler_cls.__name__, (handler_cls,), {"latency": latency})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _rng(*keys) -> np.random.Generator:
+    return np.random.default_rng(zlib.crc32("|".join(map(str, keys)).encode()))
+
+
+def fake_daily_items(ts_codes, trade_dates):
+    """确定性的随机日线，字段与tushare daily接口一致"""
+    fields = ["ts_code", "trade_date", "open", "high", "low", "close", "pre_close", "vol", "amount"]
+    items = []
+    for ts_code in ts_codes:
+        for trade_date in trade_dates:
+            rng = _rng(ts_code, trade_date)
+            close = round(10 + rng.normal(0, 1), 2)
+            open_ = round(close + rng.normal(0, 0.2), 2)
+            high, low = max(open_, close) + 0.1, min(open_, close) - 0.1
+            items.append([ts_code, str(trade_date), open_, high, low, close, close, rng.uniform(1e4, 1e6), 1e7])
+    return fields, items
+
+
+class TushareHandler(_JsonHandler):
+    """模拟 http://api.waditu.com/dataapi/{api_name}"""
+
+    def do_POST(self):
+        req = self._read_json()
+        params = req.get("params", {})
+        time.sleep(self.latency)
+        calendar = get_trading_calendar()
+        if req["api_name"] == "daily" and "trade_date" in params:
+            ts_codes = [f"{i:06d}.SZ" for i in range(1, 5001)]
+            fields, items = fake_daily_items(ts_codes, [params["trade_date"]])
+        elif req["api_name"] == "daily":
+            trade_dates = calendar.open_days_between(params["start_date"], params["end_date"])
+            fields, items = fake_daily_items([params["ts_code"]], trade_dates)
+        elif req["api_name"] == "stk_mins":
+            day = params["start_date"][:10]
+            times = list(pd.date_range(f"{day} 09:30", f"{day} 11:30", freq="1min")) + list(
+                pd.date_range(f"{day} 13:01", f"{day} 15:00", freq="1min")
+            )
+            fields = ["ts_code", "trade_time", "open", "close", "high", "low", "vol", "amount"]
+            items = [[params["ts_code"], f"{t:%Y-%m-%d %H:%M:%S}", 10, 10.1, 10.2, 9.9, 1e3, 1e4] for t in times]
+        else:
+            self._send_json({"code": 40101, "msg": f"不支持的接口 {req['api_name']}", "data": None})
+            return
+        self._send_json({"code": 0, "msg": "", "data": {"fields": fields, "items": items}})
+
+
+def fake_embedding(text: str) -> list:
+    """由文本确定的单位向量，相同文本得到相同向量"""
+    vector = _rng(text).normal(size=EMBEDDING_DIM)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class SiliconFlowHandler(_JsonHandler):
+    """模拟 https://api.siliconflow.cn/v1 下的 /embeddings 与 /chat/completions"""
+
+    reply = "这是基准测试用的固定回复，" * 20
+
+    def do_POST(self):
+        req = self._read_json()
+        time.sleep(self.latency)
+        if self.path.endswith("/embeddings"):
+            inputs = req["input"] if isinstance(req["input"], list) else [req["input"]]
+            data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t)} for i, t in enumerate(inputs)]
+            self._send_json({"object": "list", "model": req["model"], "data": data})
+        elif self.path.endswith("/chat/completions"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for i in range(0, len(self.reply), 8):
+                chunk = {"choices": [{"delta": {"content": self.reply[i : i + 8]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        else:
+            self.send_error(404)
@@ -0,0 +1,147 @@
+"""分析请求全链路基准：行情数据 → 渲染 → 文档切块 → 知识库入库/检索 → 大模型流式回复
+
+tushare与硅基流动接口由本地假服务代替（见 bench/fakes.py），可配置延迟；
+每个阶段分别以单会话与N个并发会话运行，输出p50/p95延迟与吞吐。
+需要 .streamlit/secrets.toml（token可以填任意值）。在项目根目录运行：
+    uv run python -m bench.pipeline --sessions 8 --requests 10 --tushare-latency 0.05 --siliconflow-latency 0.1
+    uv run python -m bench.pipeline --json baseline.json    # 保存结果作为基线
+"""
+import io
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from tushare.pro.client import DataApi
+
+import rag.embedding
+import llm.siliconflow
+import tools.scheduler
+import tools.stock_data
+import rag.embedding_cache
+from rag.base import UserKnowledgeBase, SharedKnowledgeBase
+from rag.chunk import chunk_document
+from bench.fakes import FakeServer, TushareHandler, SiliconFlowHandler
+from tools.render import render_kline
+from tools.bar_store import DailyBarStore
+from tools.stock_data import StockData
+from tools.symbol_table import get_symbol_table
+from rag.embedding_cache import EmbeddingCache
+from tools.trade_calendar import get_trading_calendar
+
+WINDOW = 120
+SAMPLE_TEXT = "某券商研究报告：公司主营业务稳健增长，毛利率同比提升，现金流改善。" * 400
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_stage(fn, sessions: int, requests: int) -> dict:
+    """sessions个会话并发，每个会话依次发起requests次请求"""
+
+    def session(session_idx: int):
+        costs = []
+        for i in range(requests):
+            begin = time.perf_counter()
+            fn(session_idx, i)
+            costs.append((time.perf_counter() - begin) * 1000)
+        return costs
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        costs = [c for result in executor.map(session, range(sessions)) for c in result]
+    wall = time.perf_counter() - begin
+    return {
+        "p50_ms": statistics.median(costs),
+        "p95_ms": percentile(costs, 0.95),
+        "throughput": len(costs) / wall,
+    }
+
+
+def stock_queries(session: int, request: int, tag: str, n: int = 5) -> list:
+    return [f"{tag}{session}-{request}-{j} 股票基本面与现金流" for j in range(n)]
+
+
+def build_stages(sessions: int, data_root: str) -> dict:
+    calendar = get_trading_calendar()
+    end_date = calendar.last_day
+    start_date = calendar.start_of_window(end_date, WINDOW)
+    ts_codes = get_symbol_table().ts_codes
+    sd = StockData(token="bench")
+    hot_bars = sd.daily(ts_codes[0], start_date, end_date)
+    cold_counter = iter(range(1, len(ts_codes)))
+    doc_bytes = SAMPLE_TEXT.encode("utf-8")
+    chunks = chunk_document(doc_bytes, "bench.txt", max_chunks=20)
+    shared = SharedKnowledgeBase(f"{data_root}/shared")
+    knowledge_bases = [UserKnowledgeBase(f"bench{s}", shared) for s in range(sessions)]
+    for knowledge_base in knowledge_bases:
+        knowledge_base.add_document(chunks)
+    messages = [{"role": "user", "content": [{"text": "分析一下这个图的形态学走势", "type": "text"}]}]
+
+    return {
+        "daily（本地未命中）": lambda s, i: sd.daily(ts_codes[next(cold_counter)], start_date, end_date),
+        "daily（本地命中）": lambda s, i: sd.daily(ts_codes[0], start_date, end_date),
+        "render（fast）": lambda s, i: render_kline(hot_bars, "default", "fast"),
+        "render（mplfinance）": lambda s, i: render_kline(hot_bars, "default", "mplfinance"),
+        "chunk_document": lambda s, i: chunk_document(doc_bytes, "bench.txt"),
+        "add_document": lambda s, i: knowledge_bases[s].add_document(chunks),
+        "search": lambda s, i: knowledge_bases[s].search("公司现金流", k=3),
+        # 5只股票的查询，每次请求用不同的查询语句以避开查询缓存
+        "search×5（逐条）": lambda s, i: [knowledge_bases[s].search(q, k=3) for q in stock_queries(s, i, "single")],
+        "search_many×5": lambda s, i: knowledge_bases[s].search_many(stock_queries(s, i, "many"), k=3),
+        "llm": lambda s, i: "".join(llm.siliconflow.get_stream_dsvl2_response(messages)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析请求全链路基准")
+    parser.add_argument("--sessions", type=int, default=8, help="并发会话数")
+    parser.add_argument("--requests", type=int, default=10, help="每个会话的请求数")
+    parser.add_argument("--tushare-latency", type=float, default=0.05, help="假tushare接口延迟（秒）")
+    parser.add_argument("--siliconflow-latency", type=float, default=0.1, help="假硅基流动接口延迟（秒）")
+    parser.add_argument("--stages", nargs="*", default=None, help="只运行指定阶段")
+    parser.add_argument("--json", default=None, help="结果保存路径")
+    args = parser.parse_args()
+
+    tushare = FakeServer(TushareHandler, args.tushare_latency)
+    siliconflow = FakeServer(SiliconFlowHandler, args.siliconflow_latency)
+    with tushare, siliconflow, tempfile.TemporaryDirectory() as data_root:
+        # 指向假服务与临时K线库、向量缓存，基准不受调度器限流影响
+        DataApi._DataApi__http_url = f"{tushare.url}/dataapi"
+        rag.embedding.SILICON_FLOW_BASE_URL = f"{siliconflow.url}/v1"
+        llm.siliconflow.SILICON_FLOW_BASE_URL = f"{siliconflow.url}/v1"
+        tools.scheduler.USER_RATE_PER_MIN = 10**6
+        store = DailyBarStore(data_root)
+        tools.stock_data.get_daily_bar_store = lambda: store
+        embedding_cache = EmbeddingCache(f"{data_root}/embedding_cache")
+        rag.embedding_cache.get_embedding_cache = lambda: embedding_cache
+
+        stages = build_stages(args.sessions, data_root)
+        results = {}
+        print(f"{'阶段':<20} {'会话':>4} {'p50(ms)':>10} {'p95(ms)':>10} {'吞吐(次/秒)':>12}")
+        for name, fn in stages.items():
+            if args.stages and name not in args.stages:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn(0, -1)  # 预热：渲染进程池启动、模块首次导入等一次性开销不计入
+            for sessions in sorted({1, args.sessions}):
+                with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽流式回复逐字打印
+                    result = run_stage(fn, sessions, args.requests)
+                results[f"{name}@{sessions}"] = result
+                print(
+                    f"{name:<20} {sessions:>4} {result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f}"
+                    f" {result['throughput']:>12.1f}"
+                )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""K线渲染引擎基准：比较 mplfinance 与 fast 两种引擎在不同窗口下的单次渲染耗时
+
+在项目根目录运行：
+    uv run python -m bench.render --repeat 20
+"""
+import time
+import argparse
+import statistics
+
+import numpy as np
+import pandas as pd
+
+from tools.render import ENGINES, _init_worker
+
+WINDOWS = [5, 10, 20, 60, 120, 240]
+
+
+def make_bars(n: int, seed: int = 0) -> pd.DataFrame:
+    """生成n根随机游走的日线"""
+    rng = np.random.default_rng(seed)
+    closes = 10 + np.cumsum(rng.normal(0, 0.2, n))
+    opens = closes + rng.normal(0, 0.1, n)
+    return pd.DataFrame(
+        {
+            "order_book_id": "000001.SZ",
+            "open": opens,
+            "close": closes,
+            "high": np.maximum(opens, closes) + rng.uniform(0, 0.2, n),
+            "low": np.minimum(opens, closes) - rng.uniform(0, 0.2, n),
+            "volume": rng.uniform(1e4, 1e6, n),
+            "amount": rng.uniform(1e6, 1e8, n),
+        },
+        index=pd.DatetimeIndex(pd.bdate_range("2024-01-02", periods=n), name="trade_date"),
+    )
+
+
+def bench_engine(engine: str, df: pd.DataFrame, repeat: int) -> list:
+    render = ENGINES[engine]
+    render(df, "default")  # 预热，排除首次导入的开销
+    costs = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        render(df, "default")
+        costs.append((time.perf_counter() - begin) * 1000)
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="K线渲染引擎基准")
+    parser.add_argument("--repeat", type=int, default=20, help="每个窗口重复渲染次数")
+    args = parser.parse_args()
+
+    _init_worker()
+    print(f"{'窗口':>6} {'mplfinance p50(ms)':>20} {'fast p50(ms)':>14} {'加速比':>8}")
+    for window in WINDOWS:
+        df = make_bars(window)
+        p50 = {engine: statistics.median(bench_engine(engine, df, args.repeat)) for engine in ENGINES}
+        print(f"{window:>6} {p50['mplfinance']:>20.1f} {p50['fast']:>14.1f} {p50['mplfinance'] / p50['fast']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,4 +2,10 @@ import streamlit as st
 
 TUSHARE_TOKEN = st.secrets["TUSHARE_TOKEN"]
 SILICON_FLOW_TOKEN = st.secrets["SILICON_FLOW_TOKEN"]
-ST_AUTHENTICATE_KEY = st.secrets["ST_AUTHENTICATE_KEY"]
\ No newline at end of file
+ST_AUTHENTICATE_KEY = st.secrets["ST_AUTHENTICATE_KEY"]
+SILICON_FLOW_BASE_URL = st.secrets.get("SILICON_FLOW_BASE_URL", "https://api.siliconflow.cn/v1")
+EMBEDDING_BACKEND = st.secrets.get("EMBEDDING_BACKEND", "remote")  # remote / local / local_fallback
+LOCAL_EMBEDDING_MODEL_DIR = st.secrets.get("LOCAL_EMBEDDING_MODEL_DIR", "data/models/bce-embedding-base_v1")
+VECTOR_STORAGE = st.secrets.get("VECTOR_STORAGE", "float32")  # float32 / fp16 / sq8
+VECTOR_RERANK = st.secrets.get("VECTOR_RERANK", True)  # 压缩存储时是否用原始向量精确重排
+CHART_ENGINE = st.secrets.get("CHART_ENGINE", "mplfinance")  # mplfinance / fast，fast为批量绘制的快速引擎，需显式开启
@@ -1,6 +1,6 @@
 import base64
 import requests, json
-from config import SILICON_FLOW_TOKEN
+from config import SILICON_FLOW_TOKEN, SILICON_FLOW_BASE_URL
 
 # https://cloud.siliconflow.cn/models
 sk = SILICON_FLOW_TOKEN
@@ -14,7 +14,7 @@ def get_stream_dsvl2_response(messages, **kwargs):
     """
     调用硅基流动的流式 API
     """
-    url = "https://api.siliconflow.cn/v1/chat/completions"
+    url = f"{SILICON_FLOW_BASE_URL}/chat/completions"
     headers = {
         "Authorization": f"Bearer {sk}",
         "Content-Type": "application/json"
@@ -3,7 +3,7 @@ from datetime import datetime, timedelta
 import pandas as pd
 import streamlit as st
 from tools.callback import botton_callback
-from tools.stock_data import load_stock_basic
+from tools.symbol_table import get_symbol_table
 from tools.subscribe import get_subscriptions, MAX_SUBSCRIPTION, del_subscription, add_subscription
 
 
@@ -12,7 +12,7 @@ def add_subscription_dialog(subscriptions: list):
     add_form = st.form("add subscription")
     cols = add_form.columns(3)
     type_ = cols[0].selectbox("类型", ["stock"])
-    stock_id = cols[1].selectbox("股票", stock_basic_df["ts_code"])
+    stock_id = cols[1].selectbox("股票", get_symbol_table().ts_codes)
     if cols[-1].form_submit_button("确定", on_click=botton_callback, args=(f"添加订阅 {stock_id}",)):
         try:
             add_subscription(stock_id, type_, subscriptions)
@@ -56,7 +56,6 @@ if st.session_state.get("authentication_status"):
         else:
             st.badge("当前无订阅股票公告", color='orange')
 
-    stock_basic_df = load_stock_basic()
     bts = st.columns(3)
     if len(on_df) < MAX_SUBSCRIPTION:
         if bts[0].button("添加订阅"):
@@ -1,46 +1,93 @@
-import time
 import streamlit as st
-from rag.chunk import chunk_document
-from rag.base import UserKnowledgeBase
+from rag.base import get_user_knowledge_base
+from rag.jobs import get_ingestion_queue
+from rag.document_store import content_hash
 from tools.callback import botton_callback
 
 st.markdown("# 📈 知识库管理")
 
-if 'rag_meta_data' not in st.session_state:
-    st.session_state.rag_meta_data = []
-if 'rag_faiss_index' not in st.session_state:
-    st.session_state.rag_faiss_index = None
-if 'rag_cache_name' not in st.session_state:
-    st.session_state.rag_cache_name = ""
+MAX_DOCUMENTS = 5  # 每个用户最多保存的文档数
+MAX_CHUNKS_PER_DOCUMENT = 20  # 每篇文档最多抽取的知识块数
+PROGRESS_REFRESH_SECONDS = 1  # 入库进度的刷新间隔
 
-if ('rag_meta_data' not in st.session_state) or (st.session_state.rag_meta_data == []):
+if 'rag_cache_hash' not in st.session_state:
+    st.session_state.rag_cache_hash = ""
+
+# 知识库按用户名持久化，刷新页面或重启服务都不会丢失
+knowledge_base = None
+if st.session_state.get("authentication_status"):
+    knowledge_base = get_user_knowledge_base(st.session_state.get("username"))
+
+# 上一个入库任务的结果，任务结束后整页刷新时显示一次
+if st.session_state.get("rag_job_result"):
+    status, msg = st.session_state.pop("rag_job_result")
+    if status == 'success':
+        st.success(msg)
+    else:
+        st.error(msg)
+
+if (knowledge_base is None) or (len(knowledge_base) == 0):
     st.badge('当前无知识库，请上传文档文件', color='orange')
 else:
-    st.badge(f'当前知识库已有{len(st.session_state.rag_meta_data)}个知识块，点击下方查看', color='green')
+    st.badge(f'当前知识库已有{len(knowledge_base.documents)}篇文档、{len(knowledge_base)}个知识块', color='green')
+    for source_file, chunk_ids in list(knowledge_base.documents.items()):
+        d1, d2, d3 = st.columns([4, 1, 1])
+        d1.markdown(f"📄 {source_file}")
+        d2.markdown(f"{len(chunk_ids)}个知识块")
+        if d3.button("删除", key=f"rag_del_{source_file}", on_click=botton_callback, args=(f"知识库文档删除 {source_file}",)):
+            knowledge_base.remove_document(source_file)
+            st.rerun()
     with st.expander('查看知识库切块文档'):
-        st.write(st.session_state.rag_meta_data)
+        st.write(knowledge_base.metadata)
+
+
+@st.fragment(run_every=PROGRESS_REFRESH_SECONDS)
+def show_ingestion_progress():
+    """只重跑这一段来轮询后台入库任务，任务结束后整页刷新以更新文档列表"""
+    job = get_ingestion_queue().get(st.session_state.get("rag_job_id"))
+    if job is None:  # 任务状态已过期或服务重启过
+        st.session_state.rag_job_id = None
+        return
+    if not job.done:
+        st.progress(job.progress, text=f'{job.file_name}：{job.message}')
+        return
+    st.session_state.rag_job_id = None
+    st.session_state.rag_job_result = (job.status, job.message)
+    if job.status != 'success':
+        st.session_state.rag_cache_hash = ""  # 失败的文档允许重新上传
+    st.rerun(scope="app")
 
-if st.session_state.get("authentication_status") is None:
+
+if st.session_state.get("rag_job_id"):
+    show_ingestion_progress()
+
+if knowledge_base is None:
     st.badge('请登录后再上传文档！', color='orange')
 else:
-    st.markdown('由于计算存储资源限制，在线版仅支持上传**1篇文档**，并仅抽取**前10000字**（切成20块用于智能匹配），更高定制需求请到首页联系AFAN')
-total_file = st.file_uploader("请上传文档文件，会替换原有知识库知识", type={'docx', 'pdf', 'txt'},
+    st.markdown(f'由于计算存储资源限制，在线版最多保存**{MAX_DOCUMENTS}篇文档**，每篇仅抽取**前10000字**（切成{MAX_CHUNKS_PER_DOCUMENT}块用于智能匹配），更高定制需求请到首页联系AFAN')
+total_file = st.file_uploader("请上传文档文件，会追加到知识库，同名文档会被替换", type={'docx', 'pdf', 'txt'},
                               on_change=botton_callback, args=('知识库文档上传', ),
-                              disabled= st.session_state.get("authentication_status") is None)
+                              disabled= knowledge_base is None)
 if total_file is not None:
-    if total_file.name == st.session_state.rag_cache_name:
-        st.badge('当前文档已存入知识库，请替换文档或直接进入股票分析界面使用', color='orange')
+    # 按文件内容而不是文件名判断是否重复上传：改名的副本不会重复入库，同名但内容已修改的文件会重新入库
+    data = total_file.getvalue()
+    digest = content_hash(data)
+    if digest == st.session_state.rag_cache_hash:
+        st.badge('当前文档已提交入库，请替换文档或直接进入股票分析界面使用', color='orange')
         st.stop()
-    else:
-        st.session_state.rag_cache_name = total_file.name
-    chunks = chunk_document(total_file, total_file.name)
-    st.badge('文件读取成功，正在存入知识库...')
-    status, data, msg = UserKnowledgeBase.add_document(chunks[:20])
-    if status == 'success':
-        st.success(msg)
-        st.badge('3秒钟之后自动刷新页面...')
-        time.sleep(3)
-        st.rerun()
-    else:
-        st.error(msg)
+    if st.session_state.get("rag_job_id"):
+        st.badge('上一篇文档正在入库，请稍后再上传', color='orange')
+        st.stop()
+    existing = knowledge_base.find_document(digest)
+    if existing is not None:
+        st.badge(f'该文档内容已在知识库中（{existing}），无需重复上传', color='orange')
+        st.stop()
+    if (total_file.name not in knowledge_base.documents) and (len(knowledge_base.documents) >= MAX_DOCUMENTS):
+        st.error(f'知识库最多保存{MAX_DOCUMENTS}篇文档，请先删除不需要的文档')
         st.stop()
+    st.session_state.rag_cache_hash = digest
+    # 解析和向量化在后台任务中进行，页面只轮询进度，不会阻塞当前会话
+    st.session_state.rag_job_id = get_ingestion_queue().submit(
+        st.session_state.get("username"), data, total_file.name, MAX_CHUNKS_PER_DOCUMENT
+    )
+    st.rerun()
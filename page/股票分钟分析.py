@@ -1,57 +1,37 @@
 import datetime
 from io import BytesIO
 
-import pandas as pd
 import streamlit as st
-import mplfinance as mpf
-import matplotlib.pyplot as plt
 
+from view.stock_select import stock_selectbox
 from view.llm_qa import single_content_qa
-from tools.callback import botton_callback
+from tools.callback import botton_callback, get_session_user
 from tools.stock_data import StockData
+from tools.chart_cache import get_chart_cache, chart_ttl
+from tools.render import render_kline
+from config import CHART_ENGINE
+from tools.trade_calendar import get_trading_calendar
 
 st.markdown("# 📈 股票分钟分析")
 
+CHART_STYLE = "default"
+
 if "stock_min_bar" not in st.session_state:
     st.session_state.stock_min_bar = False
 if "cache_stock_min_bar" not in st.session_state:
     st.session_state.cache_stock_min_bar = {}
 
 
-# 如果不是交易日，往前找最近的交易日
-def get_nearest_trading_day(selected_date, open_date_df):
-    calendar_dates = pd.to_datetime(open_date_df["cal_date"]).dt.date
-    valid_dates = calendar_dates[calendar_dates <= selected_date]
-    if len(valid_dates) == 0:
-        return None
-    return valid_dates.max()
-
-
-@st.cache_data
-def load_stock_basic():
-    return pd.read_csv("data/stock_basic.csv")
-
-
-@st.cache_data
-def load_stock_open_day():
-    df = pd.read_csv("data/stock_calender.csv").sort_values(by="cal_date", ascending=True)
-    df["cal_date"] = pd.to_datetime(df["cal_date"], format="%Y%m%d")
-    df = df[df["is_open"] == 1]
-    df.index = range(df.shape[0])
-    return df
-
-
 def stock_kline_analysis():
     """股票K线分析"""
-    stock_basic_df = load_stock_basic()
-    open_date_df = load_stock_open_day()
-    stock_list = stock_basic_df["ts_code"].tolist()
+    calendar = get_trading_calendar()
+    chart_cache = get_chart_cache()
 
     s1, s2, s3 = st.columns([1, 1, 1])
-    stock_id = s1.selectbox("请选择股票ID，支持手动输入", options=stock_list, index=None)
+    stock_id = stock_selectbox(s1, key="min_stock_id")
     now = datetime.datetime.now()
     end_date: datetime.date = s2.date_input("请选择日期，分析仅限日内", value=now)
-    real_end_date: datetime.date = get_nearest_trading_day(end_date, open_date_df)
+    real_end_date: datetime.date = calendar.nearest_open_day(end_date)  # 如果不是交易日，往前找最近的交易日
     if real_end_date is None:
         st.error("所选日期非有效交易日，请重新选择")
         st.stop()
@@ -79,29 +59,24 @@ def stock_kline_analysis():
     if st.session_state.stock_min_bar:
         if not st.session_state.cache_stock_min_bar:
             if st.session_state.user_tushare_token == "":
-                sd = StockData()
+                sd = StockData(user=get_session_user())
             else:  # 如果自定义了token
-                sd = StockData(token=st.session_state.user_tushare_token)
+                sd = StockData(token=st.session_state.user_tushare_token, user=get_session_user())
             stock_info_dict = sd.stock_info(stock_id)
-            adj_df = sd.min(
-                stock_id,
-                frequency,
-                datetime.datetime.combine(end_date, datetime.time(9, 0, 0)),
-                datetime.datetime.combine(end_date, datetime.time(15, 0, 0)),
-            )
-            # 设置mplfinance的蜡烛颜色，up为阳线颜色，down为阴线颜色
-            my_color = mpf.make_marketcolors(up="r", down="g", edge="inherit", wick="inherit", volume="inherit")
-            # 设置图表的背景色
-            my_style = mpf.make_mpf_style(
-                marketcolors=my_color,
-                figcolor="(0.82, 0.83, 0.85)",
-                gridcolor="(0.82, 0.83, 0.85)",
-            )
-            mpf.plot(adj_df, style=my_style, type="candle", volume=True, returnfig=True)
-            # 保存到内存缓冲区
-            buffer = BytesIO()
-            plt.savefig(buffer, format="png")
-            buffer.seek(0)
+            # 相同股票、频率、日期的图表跨会话共享
+            chart_key = ("min", stock_id, frequency, end_date, CHART_STYLE, CHART_ENGINE)
+            chart = chart_cache.get(chart_key)
+            if chart is None:
+                adj_df = sd.min(
+                    stock_id,
+                    frequency,
+                    datetime.datetime.combine(end_date, datetime.time(9, 0, 0)),
+                    datetime.datetime.combine(end_date, datetime.time(15, 0, 0)),
+                )
+                png = render_kline(adj_df, CHART_STYLE, CHART_ENGINE)
+                chart = {"bars": adj_df, "png": png}
+                chart_cache.put(chart_key, chart, ttl=chart_ttl(end_date))
+            buffer = BytesIO(chart["png"])
             # 显示图片
             st.image(buffer)
             st.session_state.cache_stock_min_bar = {
@@ -114,7 +89,7 @@ def stock_kline_analysis():
             stock_info_dict = st.session_state.cache_stock_min_bar["stock_info_dict"]
 
         content = {"img": [{"value": stock_min_bar_img_path}]}
-        single_content_qa(content=content)
+        single_content_qa(img_content=content)
         st.markdown(
             f"**股票代码**：{stock_id} **股票名称**：{stock_info_dict['name']} "
             f"**行业**：{stock_info_dict['industry']}  **地区**：{stock_info_dict['area']} **上市日期**：{stock_info_dict['list_date']}"
@@ -0,0 +1,131 @@
+"""全市场日线回补：按trade_date逐日拉取全市场截面写入本地日线库
+
+可断点续跑、重复执行结果一致，已完成的交易日记录在 data/bars/backfill_progress.json。
+在项目根目录运行：
+    uv run python -m prepare.backfill --start 20160101      # 一次性回补
+    uv run python -m prepare.backfill --nightly             # 常驻进程，每天收盘数据更新后增量回补
+也可以不用 --nightly，直接用 crontab 在每个交易日 17:30 执行一次。
+"""
+import os
+import json
+import time
+import argparse
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from tools.bar_store import BAR_STORE_ROOT, DAILY_READY_TIME, last_complete_day, get_daily_bar_store
+from tools.stock_data import StockData
+from tools.symbol_table import get_symbol_table
+from tools.trade_calendar import from_int_date, extend_calendar, get_trading_calendar
+
+PROGRESS_PATH = os.path.join(BAR_STORE_ROOT, "backfill_progress.json")
+
+
+def load_progress() -> set:
+    if not os.path.exists(PROGRESS_PATH):
+        return set()
+    with open(PROGRESS_PATH) as f:
+        return set(json.load(f)["done"])
+
+
+def save_progress(done: set):
+    tmp_path = f"{PROGRESS_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"done": sorted(done), "update_time": datetime.now().isoformat()}, f)
+    os.replace(tmp_path, PROGRESS_PATH)
+
+
+def pending_trade_dates(start: date, end: date, done: set) -> list:
+    days = get_trading_calendar().open_days_between(start, end)
+    return [int(d) for d in days if int(d) not in done]
+
+
+def flush(batch: list, bars: list, universe: list, done: set):
+    """把一批交易日的截面按股票合并后一次性写入，写完才记录进度"""
+    store = get_daily_bar_store()
+    batch_bars = pd.concat(bars) if bars else pd.DataFrame()
+    store.write_cross_sections(batch_bars, from_int_date(batch[0]), from_int_date(batch[-1]), universe)
+    done.update(batch)
+    save_progress(done)
+
+
+def refresh_calendar(end: date):
+    """交易日历不够用时从tushare补到end所在年份的年底，年底之后的日历通常要到12月才发布"""
+    calendar = get_trading_calendar()
+    if end <= calendar.last_day:
+        return
+    rows = StockData().trade_cal(calendar.last_day + timedelta(days=1), date(end.year, 12, 31))
+    calendar = extend_calendar(rows)
+    if end > calendar.last_day:
+        print(f"[backfill] 交易日历只到{calendar.last_day}，之后的交易日暂时无法回补")
+
+
+def backfill(start: date, end: date, batch_size: int = 60, interval: float = 0.3):
+    refresh_calendar(end)
+    done = load_progress()
+    trade_dates = pending_trade_dates(start, end, done)
+    total = len(trade_dates)
+    if total == 0:
+        print(f"[backfill] {start} ~ {end} 已全部回补，无需拉取")
+        return
+
+    sd = StockData()
+    calendar = get_trading_calendar()
+    universe = get_symbol_table().ts_codes
+    begin = time.time()
+    batch, bars = [], []
+    for i, trade_date in enumerate(trade_dates, start=1):
+        # 交易日历内连续的交易日才能合并为一个覆盖区间
+        if batch and calendar.index_of(from_int_date(trade_date)) != calendar.index_of(from_int_date(batch[-1])) + 1:
+            flush(batch, bars, universe, done)
+            batch, bars = [], []
+
+        stock_df = sd.daily_cross_section(from_int_date(trade_date))
+        batch.append(trade_date)
+        bars.append(stock_df)
+
+        elapsed = time.time() - begin
+        eta = elapsed / i * (total - i)
+        print(f"[backfill] {trade_date} {len(stock_df)}只股票 ({i}/{total}, {i / total:.1%}) 预计剩余{eta / 60:.1f}分钟")
+
+        if len(batch) >= batch_size:
+            flush(batch, bars, universe, done)
+            batch, bars = [], []
+        time.sleep(interval)  # 控制请求频率，避免触发tushare限流
+
+    if batch:
+        flush(batch, bars, universe, done)
+    print(f"[backfill] 完成{total}个交易日，耗时{(time.time() - begin) / 60:.1f}分钟")
+
+
+def seconds_until_next_run(now: datetime = None) -> float:
+    now = now or datetime.now()
+    next_run = datetime.combine(now.date(), DAILY_READY_TIME) + timedelta(minutes=30)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按交易日回补全市场日线到本地日线库")
+    parser.add_argument("--start", default=f"{get_trading_calendar().first_day:%Y%m%d}", help="开始日期，YYYYMMDD")
+    parser.add_argument("--end", default=None, help="结束日期，YYYYMMDD，默认最近一个数据完整的交易日")
+    parser.add_argument("--batch-size", type=int, default=60, help="每多少个交易日合并写盘一次")
+    parser.add_argument("--interval", type=float, default=0.3, help="两次请求之间的间隔秒数")
+    parser.add_argument("--nightly", action="store_true", help="常驻运行，每天收盘数据更新后自动增量回补")
+    args = parser.parse_args()
+
+    start = from_int_date(int(args.start))
+    while True:
+        end = from_int_date(int(args.end)) if args.end else last_complete_day()
+        backfill(start, end, args.batch_size, args.interval)
+        if not args.nightly:
+            break
+        wait = seconds_until_next_run()
+        print(f"[backfill] 下次回补将在{wait / 3600:.1f}小时后开始")
+        time.sleep(wait)
+
+
+if __name__ == "__main__":
+    main()
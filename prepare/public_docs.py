@@ -0,0 +1,34 @@
+"""公共研报入库：把目录下的文档作为public租户写入共享知识库，所有用户检索时都能命中
+
+在项目根目录运行：
+    uv run python -m prepare.public_docs data/reports --topic 白酒
+同名文档重复执行会被替换。
+"""
+import os
+import argparse
+
+from rag.base import DEFAULT_TOPIC, PUBLIC_TENANT, get_shared_knowledge_base
+from rag.chunk import chunk_document
+
+SUPPORTED_EXTS = {".pdf", ".docx", ".txt"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="公共研报入库")
+    parser.add_argument("path", help="文档目录")
+    parser.add_argument("--topic", default=DEFAULT_TOPIC, help="主题标签")
+    parser.add_argument("--max-chunks", type=int, default=None, help="每篇文档最多抽取的知识块数")
+    args = parser.parse_args()
+
+    knowledge_base = get_shared_knowledge_base()
+    for name in sorted(os.listdir(args.path)):
+        if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTS:
+            continue
+        with open(os.path.join(args.path, name), "rb") as f:
+            chunks = chunk_document(f.read(), name, max_chunks=args.max_chunks)
+        status, _, msg = knowledge_base.add_document(chunks, PUBLIC_TENANT, args.topic)
+        print(f"{name}: {len(chunks)}个知识块，{msg}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,435 @@
+import os
+import re
+import json
+import fcntl
+import threading
+from uuid import uuid4
+from typing import Set, Dict, List, Callable, Optional
+from contextlib import contextmanager
+from concurrent.futures import TimeoutError, ThreadPoolExecutor
+
 import faiss
 import numpy as np
-from uuid import uuid4
 import streamlit as st
-from typing import Dict, List, Optional
-from rag.embedding import netease_youdao_embedding
+from cachetools import LRUCache, func
+
+from config import VECTOR_RERANK, VECTOR_STORAGE
+from rag.index import (
+    tune,
+    kind_of,
+    normalize,
+    exact_rank,
+    index_kind,
+    storage_of,
+    build_index,
+    is_normalized,
+    search_params,
+    matches_storage,
+    supports_remove,
+)
+from rag.lexical import BM25Index, rrf_fuse
+from rag.embedding_backend import EmbeddingBackend, get_embedding_backend
 
 EMBEDDING_DIM = 768
+VECTOR_BYTES = EMBEDDING_DIM * 4  # 向量文件中每行float32向量的字节数
+QUERY_CACHE_SIZE = 1024  # 查询向量LRU容量，日线分析页同一股票的查询语句固定
+SHARED_KNOWLEDGE_BASE_ROOT = "data/rag/shared"
+KNOWLEDGE_BASE_ROOT = "data/rag/users"  # 旧版本按用户分目录的知识库，首次加载共享知识库时迁移进去
+PUBLIC_TENANT = "public"  # 公共研报的租户名，所有用户都可检索
+DEFAULT_TOPIC = "default"
+EXACT_SEARCH_MAX = 4096  # 可检索的知识块不超过该数量时直接在原始向量上精确计算，过滤比例高时ANN召回会变差
+CHECKPOINT_CHANGES = 4096  # 日志里增删的知识块超过该数量时并入索引、写出新的检查点
+TOMBSTONE_RATIO = 0.2  # hnsw不支持删除，已删除的向量超过索引的该比例时在检查点整体重建
+COPY_BATCH_SIZE = 4096  # 压缩向量文件时每次拷贝的行数
+RERANK_MULTIPLIER = 4  # 压缩存储时先从索引多取几倍候选，再用原始向量精确重排
+PROGRESS_GROUP_SIZE = 128  # 需要汇报进度时每组向量化的文本数，组内仍按批并发请求
+EMBEDDING_DEADLINE = 2.0  # 查询向量的等待上限（秒），超时后只用词法索引作答
+CANDIDATE_MULTIPLIER = 4  # 融合前每一路取k的倍数个候选
 
-class UserKnowledgeBase:
+_GENERATION_FILE = re.compile(r"(index|lexical|journal|vectors)-\d+\.(faiss|npz|json|jsonl|f32)(\.tmp)?")
+_query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query-embedding")
+
+_query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+_query_cache_lock = threading.Lock()
+
+
+def embed_queries(queries: List[str], embedding_fn: EmbeddingBackend = None) -> List[tuple]:
+    """查询向量：先查进程内LRU，再查磁盘向量缓存，剩下的合并成一次批量请求；失败结果不缓存"""
+    embedding_fn = embedding_fn or get_embedding_backend()
+    keys = [(embedding_fn.model, query) for query in queries]
+    with _query_cache_lock:
+        hits = [_query_cache.get(key) for key in keys]
+    missing = list(dict.fromkeys(query for query, hit in zip(queries, hits) if hit is None))
+    fetched = dict(zip(missing, embedding_fn.cached(missing))) if missing else {}
+    results = []
+    for query, key, hit in zip(queries, keys, hits):
+        if hit is not None:
+            results.append(('success', hit, '命中查询缓存'))
+            continue
+        status, query_emb, msg = fetched[query]
+        if status != 'failed':
+            query_emb = np.asarray(query_emb, dtype='float32')
+            with _query_cache_lock:
+                _query_cache[key] = query_emb
+        results.append((status, query_emb, msg))
+    return results
+
+
+def embed_query(query: str, embedding_fn: EmbeddingBackend = None):
+    return embed_queries([query], embedding_fn)[0]
+
+
+class SharedKnowledgeBase:
+    """全部署共享的知识库：公共研报和各用户的私有文档放在同一个持久化的FAISS索引里
+
+    每个知识块带tenant（用户名或public）和topic标签，检索时按标签算出可见的知识块，
+    只在这些知识块里检索，不需要为每个用户常驻一个小索引，公共研报也只向量化一次。
+    索引类型随知识块数量在flat、hnsw、ivfpq之间切换（见rag/index.py）。
+    入库时同时维护BM25词法索引，检索时与向量结果融合，向量接口超时时单独作答。
+    storage为fp16/sq8时索引以压缩编码常驻内存，rerank时用磁盘上的原始向量对候选精确重排。
+
+    磁盘上分两部分，写入的代价只与变化的知识块数量有关：
+    - 检查点：meta.json（全部metadata、代数、未从索引中删除的chunk_id）和同代的index-{代}.faiss、lexical-{代}.npz
+    - 增量：原始向量追加写入vectors文件，每次增删追加一行到journal-{代}.jsonl，各副本读取日志新增的部分即可同步
+    日志里的增删累计超过CHECKPOINT_CHANGES或规模跨过档位时，才把增量并入索引写出新一代检查点，
+    新知识块直接追加进索引，只有跨档位、存储方式变化或hnsw删除过多时才整体重建。
+    还没并入索引的新知识块在检索时用原始向量精确计算，与索引的结果合并。
+    """
+
+    def __init__(self, root: str = SHARED_KNOWLEDGE_BASE_ROOT, storage: str = VECTOR_STORAGE,
+                 rerank: bool = VECTOR_RERANK):
+        self.dir = root
+        self.storage = storage
+        self.rerank = rerank
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.lock_path = os.path.join(self.dir, ".lock")
+        self._lock = threading.RLock()  # 保护内存中的状态，只在读写内存时短暂持有
+        self._write_lock = threading.Lock()  # 进程内的写入串行，写磁盘期间检索照常进行
+        self._stamp = None
+        self._generation: Optional[int] = None
+        self._journal_offset = 0
+        self._journal_changes = 0  # 当前日志里增删的知识块数
+        self._index: Optional[faiss.Index] = None
+        self._lexical: Optional[BM25Index] = None
+        self._vectors: Optional[np.ndarray] = None
+        self.vectors_path = os.path.join(self.dir, "vectors-0.f32")
+        self.meta_map: Dict[int, Dict] = {}  # chunk_id -> metadata，按入库顺序
+        self.ids = np.empty(0, dtype=np.int64)  # 向量行号 -> chunk_id，已删除的行为-1
+        self.row_of: Dict[int, int] = {}  # chunk_id -> 向量行号
+        self.documents: Dict[str, Dict[str, List[int]]] = {}  # tenant -> source_file -> chunk_id列表
+        self.tenant_rows: Dict[str, np.ndarray] = {}  # tenant -> 向量行号
+        self.topic_rows: Dict[tuple, np.ndarray] = {}  # (tenant, topic) -> 向量行号
+        self.delta_rows = np.empty(0, dtype=np.int64)  # 还没并入索引的知识块的向量行号
+        self._delta_ids: Set[int] = set()
+        self._tombstones: frozenset = frozenset()  # 已删除但还在索引里的chunk_id，检索时排除
+        self.refresh()
+
+    def _path(self, name: str, generation: int = None) -> str:
+        generation = self._generation if generation is None else generation
+        suffix = {"index": "faiss", "lexical": "npz", "journal": "jsonl"}[name]
+        return os.path.join(self.dir, f"{name}-{generation}.{suffix}")
+
+    def _load_checkpoint(self, checkpoint: Dict):
+        """按检查点重置内存中的状态，索引在下次使用时再加载"""
+        metadata = checkpoint.get("metadata", [])
+        documents, tenant_rows, topic_rows = {}, {}, {}
+        ids = np.full(max((item["row"] for item in metadata), default=-1) + 1, -1, dtype=np.int64)
+        for item in metadata:
+            documents.setdefault(item["tenant"], {}).setdefault(item["source_file"], []).append(item["chunk_id"])
+            tenant_rows.setdefault(item["tenant"], []).append(item["row"])
+            topic_rows.setdefault((item["tenant"], item["topic"]), []).append(item["row"])
+            ids[item["row"]] = item["chunk_id"]
+        self._generation = checkpoint.get("generation", 0)
+        self.vectors_path = os.path.join(self.dir, checkpoint.get("vectors", "vectors-0.f32"))
+        self.meta_map = {item['chunk_id']: item for item in metadata}
+        self.ids = ids
+        self.row_of = {item["chunk_id"]: item["row"] for item in metadata}
+        self.documents = documents
+        self.tenant_rows = {key: np.array(rows, dtype=np.int64) for key, rows in tenant_rows.items()}
+        self.topic_rows = {key: np.array(rows, dtype=np.int64) for key, rows in topic_rows.items()}
+        self.delta_rows = np.empty(0, dtype=np.int64)
+        self._delta_ids = set()
+        self._tombstones = frozenset(checkpoint.get("tombstones", ()))
+        self._journal_offset, self._journal_changes = 0, 0
+        self._index, self._lexical, self._vectors = None, None, None
+
+    def _apply(self, records: List[Dict]):
+        """把日志记录（先remove后add）应用到内存，数组只按涉及的租户、主题各更新一次"""
+        removed_rows, added_rows = {}, {}  # tenant或(tenant, topic) -> 向量行号
+        removed_ids, dead_rows, added_items, touched = set(), [], [], set()
+        tombstones = set()
+        for record in records:
+            for chunk_id in record.get("remove", ()):
+                item = self.meta_map.pop(chunk_id, None)
+                if item is None:
+                    continue
+                row = self.row_of.pop(chunk_id)
+                dead_rows.append(row)
+                for key in (item["tenant"], (item["tenant"], item["topic"])):
+                    removed_rows.setdefault(key, []).append(row)
+                touched.add((item["tenant"], item["source_file"]))
+                removed_ids.add(chunk_id)
+                if chunk_id in self._delta_ids:
+                    self._delta_ids.discard(chunk_id)
+                else:
+                    tombstones.add(chunk_id)
+            for item in record.get("add", ()):
+                chunk_id = item["chunk_id"]
+                self.meta_map[chunk_id] = item
+                self.row_of[chunk_id] = item["row"]
+                self.documents.setdefault(item["tenant"], {}).setdefault(item["source_file"], []).append(chunk_id)
+                for key in (item["tenant"], (item["tenant"], item["topic"])):
+                    added_rows.setdefault(key, []).append(item["row"])
+                self._delta_ids.add(chunk_id)
+                added_items.append(item)
+            self._journal_changes += len(record.get("remove", ())) + len(record.get("add", ()))
+
+        # 行号数组换成新对象，正在检索的线程拿到的仍是一致的旧数组；ids里删除的行原地置为-1，结果按meta_map过滤
+        for tenant, source_file in touched:
+            docs = self.documents[tenant]
+            kept = [chunk_id for chunk_id in docs[source_file] if chunk_id not in removed_ids]
+            if kept:
+                docs[source_file] = kept
+            else:
+                del docs[source_file]
+                if not docs:
+                    del self.documents[tenant]
+        removed = {key: np.array(rows, dtype=np.int64) for key, rows in removed_rows.items()}
+        for key in set(removed_rows) | set(added_rows):
+            table = self.topic_rows if isinstance(key, tuple) else self.tenant_rows
+            rows = np.concatenate([table.get(key, np.empty(0, dtype=np.int64)),
+                                   np.array(added_rows.get(key, ()), dtype=np.int64)])
+            if key in removed:  # 行号不会复用，同一批里先加后删的知识块也一并去掉
+                rows = rows[~np.isin(rows, removed[key])]
+            if len(rows):
+                table[key] = rows
+            else:
+                table.pop(key, None)
+        if added_items:
+            size = max(len(self.ids), max(item["row"] for item in added_items) + 1)
+            ids = np.concatenate([self.ids, np.full(size - len(self.ids), -1, dtype=np.int64)])
+            ids[[item["row"] for item in added_items]] = [item["chunk_id"] for item in added_items]
+            self.ids = ids
+        if dead_rows:
+            self.ids[dead_rows] = -1
+        if tombstones:
+            self._tombstones = self._tombstones | tombstones
+        self.delta_rows = np.array(sorted(self.row_of[i] for i in self._delta_ids), dtype=np.int64)
+        if self._lexical is not None:
+            added_items = [item for item in added_items if item["chunk_id"] in self.meta_map]
+            self._lexical.remove(removed_ids)
+            self._lexical.add([item["chunk_id"] for item in added_items], [item["text"] for item in added_items])
+
+    def refresh(self):
+        """同步其他进程（如另一个副本）的写入：检查点变了重新加载，否则只读取日志新增的部分"""
+        try:
+            stat = os.stat(self.meta_path)
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        with self._lock:
+            if stamp != self._stamp or self._generation is None:
+                checkpoint = {}
+                if stamp is not None:
+                    with open(self.meta_path, encoding="utf-8") as f:
+                        checkpoint = json.load(f)
+                self._load_checkpoint(checkpoint)
+                self._stamp = stamp
+            journal_path = self._path("journal")
+            if not os.path.exists(journal_path) or os.path.getsize(journal_path) <= self._journal_offset:
+                return
+            with open(journal_path, "rb") as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1  # 只读取完整的行，正在写入的最后一行下次再读
+            if end:
+                self._journal_offset += end
+                self._apply([json.loads(line) for line in data[:end].splitlines() if line])
+
+    def __len__(self):
+        return len(self.meta_map)
+
+    @property
+    def metadata(self) -> List[Dict]:
+        with self._lock:
+            return list(self.meta_map.values())
+
+    def tenant_metadata(self, tenant: str) -> List[Dict]:
+        """某个租户的全部知识块"""
+        with self._lock:
+            return [self.meta_map[int(self.ids[row])] for row in self.tenant_rows.get(tenant, ())]
+
+    def _checkpoint_file(self, name: str) -> Optional[str]:
+        """当前检查点的索引文件；落后的检查点被其他副本清理掉时先重新加载最新的"""
+        if not self._generation:
+            return None
+        path = self._path(name)
+        if not os.path.exists(path):
+            self._stamp = None
+            self.refresh()
+            path = self._path(name)
+        return path if self._generation and os.path.exists(path) else None
+
+    @property
+    def index(self) -> Optional[faiss.Index]:
+        """懒加载检查点的索引，IO_FLAG_MMAP让支持的索引类型直接映射磁盘文件而不整体读入内存"""
+        with self._lock:
+            if self._index is None:
+                path = self._checkpoint_file("index")
+                if path is not None:
+                    self._index = tune(faiss.read_index(path, faiss.IO_FLAG_MMAP))
+            return self._index
+
+    @property
+    def lexical(self) -> BM25Index:
+        """懒加载检查点的词法索引，再补上日志里的增删"""
+        with self._lock:
+            if self._lexical is None:
+                path = self._checkpoint_file("lexical")
+                lexical = BM25Index.load(path) if path is not None else BM25Index()
+                lexical.remove([chunk_id for chunk_id in lexical.row_of if chunk_id not in self.meta_map])
+                added = [item for item in self.meta_map.values() if item["chunk_id"] not in lexical.row_of]
+                lexical.add([item["chunk_id"] for item in added], [item["text"] for item in added])
+                self._lexical = lexical
+            return self._lexical
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """按行号排列的原始向量，mmap方式加载，精确检索和重排只读取用到的行；文件追加后重新映射"""
+        with self._lock:
+            if self._vectors is None or len(self._vectors) < len(self.ids):
+                rows = os.path.getsize(self.vectors_path) // VECTOR_BYTES if os.path.exists(self.vectors_path) else 0
+                if rows:
+                    self._vectors = np.memmap(self.vectors_path, dtype='float32', mode="r", shape=(rows, EMBEDDING_DIM))
+                else:
+                    self._vectors = np.empty((0, EMBEDDING_DIM), dtype='float32')
+            return self._vectors
+
+    @contextmanager
+    def _writing(self):
+        """写锁：进程内用线程锁，多个副本之间用文件锁；拿到锁后先加载其他副本的最新写入"""
+        os.makedirs(self.dir, exist_ok=True)
+        with self._write_lock, open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append_vectors(self, vectors: np.ndarray) -> int:
+        """把向量追加到向量文件末尾，返回第一行的行号；上次写了一半的行先截掉，成为没有知识块引用的死行"""
+        with open(self.vectors_path, "ab") as f:
+            start = f.tell() // VECTOR_BYTES
+            f.truncate(start * VECTOR_BYTES)
+            f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+        return start
+
+    def _write(self, removed_ids: List[int], added_vectors: np.ndarray, added_metadata: List[Dict]):
+        """在写锁内调用：追加向量和一行日志，再按日志更新内存；只写变化的知识块，必要时写检查点"""
+        if len(added_metadata):
+            start = self._append_vectors(added_vectors)
+            added_metadata = [dict(item, row=start + i) for i, item in enumerate(added_metadata)]
+        record = json.dumps({"remove": removed_ids, "add": added_metadata}, ensure_ascii=False)
+        with open(self._path("journal"), "ab") as f:
+            f.truncate(self._journal_offset)  # 去掉上次写了一半的行
+            f.write(record.encode("utf-8") + b"\n")
+        self.refresh()
+        index = self.index
+        if (self._journal_changes >= CHECKPOINT_CHANGES
+                or (index is not None and (kind_of(index) != index_kind(len(self))
+                                           or not matches_storage(index, self.storage)))):
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """在写锁内调用：把日志里的增删并入新一代检查点
+
+        跨档位、存储方式变化、flat+sq8或hnsw里已删除的向量过多时整体重建，否则在上一代索引的可写副本上
+        删除（hnsw不支持删除，已删除的chunk_id留在检查点里继续排除）并追加新向量。
+        flat+sq8每次都重建：8位量化的取值范围在训练时确定，小样本训练出的范围装不下后来的向量，
+        而flat重建只是重新编码，代价很小。向量文件里的死行超过一半时顺带压缩。
+        """
+        with self._lock:
+            metadata = list(self.meta_map.values())
+            delta_ids = sorted(self._delta_ids)
+            tombstones = set(self._tombstones)
+            base, lexical, vectors = self.index, self.lexical, self.vectors
+        generation = self._generation + 1
+        ids = np.array([item["chunk_id"] for item in metadata], dtype=np.int64)
+        kind = index_kind(len(metadata))
+        if (base is None or kind_of(base) != kind or not matches_storage(base, self.storage)
+                or (kind == "flat" and self.storage == "sq8")
+                or (tombstones and not supports_remove(base) and len(tombstones) > TOMBSTONE_RATIO * base.ntotal)):
+            index = build_index(vectors[[item["row"] for item in metadata]], ids, storage=self.storage)
+            tombstones = set()
+        else:
+            # 不用clone_index：mmap加载的ivf倒排表不支持克隆，直接从磁盘读一份可写副本，不影响正在进行的检索
+            index = tune(faiss.read_index(self._path("index")))
+            if tombstones and supports_remove(index):
+                index.remove_ids(np.array(sorted(tombstones), dtype=np.int64))
+                tombstones = set()
+            if delta_ids:
+                added = np.asarray(vectors[[self.row_of[i] for i in delta_ids]])
+                index.add_with_ids(normalize(added) if is_normalized(index) else added,
+                                   np.array(delta_ids, dtype=np.int64))
+
+        vectors_name = os.path.basename(self.vectors_path)
+        if len(vectors) - len(metadata) > len(metadata):
+            vectors_name = f"vectors-{generation}.f32"
+            with open(os.path.join(self.dir, vectors_name), "wb") as f:
+                for start in range(0, len(metadata), COPY_BATCH_SIZE):
+                    rows = [item["row"] for item in metadata[start:start + COPY_BATCH_SIZE]]
+                    f.write(np.ascontiguousarray(vectors[rows], dtype='float32').tobytes())
+            metadata = [dict(item, row=row) for row, item in enumerate(metadata)]
+
+        lexical = lexical.compacted() if lexical.dead else lexical
+        # 先写好同一代的全部文件，最后替换meta.json作为提交点，进程异常退出也不会留下损坏的检查点
+        faiss.write_index(index, f"{self._path('index', generation)}.tmp")
+        os.replace(f"{self._path('index', generation)}.tmp", self._path("index", generation))
+        lexical.save(f"{self._path('lexical', generation)}.tmp")
+        os.replace(f"{self._path('lexical', generation)}.tmp", self._path("lexical", generation))
+        open(self._path("journal", generation), "wb").close()
+        checkpoint = {"generation": generation, "vectors": vectors_name,
+                      "tombstones": sorted(tombstones), "metadata": metadata}
+        with open(f"{self.meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        previous = {self._path(name) for name in ("index", "lexical", "journal")} | {self.vectors_path}
+        with self._lock:
+            os.replace(f"{self.meta_path}.tmp", self.meta_path)
+            stat = os.stat(self.meta_path)
+            self._load_checkpoint(checkpoint)
+            self._stamp = (stat.st_ino, stat.st_mtime_ns)
+            self._index, self._lexical = index, lexical
+        # 保留上一代的文件给还没刷新的读者，更早的删除
+        current = {self._path(name) for name in ("index", "lexical", "journal")} | {self.vectors_path}
+        for name in os.listdir(self.dir):
+            path = os.path.join(self.dir, name)
+            if _GENERATION_FILE.fullmatch(name) and path not in current | previous:
+                os.remove(path)
 
-    @staticmethod
     def add_document(
+            self,
             chunks: List[Dict],
-            embedding_fn=netease_youdao_embedding
+            tenant: str,
+            topic: str = DEFAULT_TOPIC,
+            embedding_fn: EmbeddingBackend = None,
+            progress: Callable[[float], None] = None,
     ):
+        """progress不为空时分组向量化，每组完成后回调已完成的比例"""
         # 处理文档块
         vectors = []
         metadata = []
         error_msg_list = []
-        for chunk in chunks:
-            status, emb, msg = embedding_fn(chunk["text"])
+        # 批量、并发获取所有文档块的向量，已缓存的直接复用
+        embedding_fn = embedding_fn or get_embedding_backend()
+        texts = [chunk["text"] for chunk in chunks]
+        group_size = PROGRESS_GROUP_SIZE if progress else max(len(texts), 1)
+        embeddings = []
+        for start in range(0, len(texts), group_size):
+            embeddings.extend(embedding_fn.cached(texts[start:start + group_size]))
+            if progress:
+                progress(len(embeddings) / len(texts))
+        for chunk, (status, emb, msg) in zip(chunks, embeddings):
             if status == 'failed':
                 error_msg_list.append(msg)
                 continue
@@ -29,55 +439,286 @@ class UserKnowledgeBase:
                 "chunk_id": chunk_uuid,
                 "text": chunk["text"],  # 存储原始文本
                 "source_file": chunk["metadata"]["source_file"],
-                "create_time": chunk["metadata"]["create_time"]
+                "create_time": chunk["metadata"]["create_time"],
+                "content_hash": chunk["metadata"].get("content_hash"),  # 上传文件的sha256，用于识别改名的重复上传
+                "tenant": tenant,
+                "topic": topic,
             })
-        # 更新索引和元数据
+        # 追加到已有索引，该租户的同名文档先删除旧的知识块
         if vectors:
-            # 合并向量数据
-            vectors_array = np.array(vectors, dtype='float32')
-            index = faiss.IndexIDMap(faiss.IndexFlatL2(EMBEDDING_DIM))
-            ids_array = np.array([item['chunk_id'] for item in metadata], dtype=np.int64)
-            index.add_with_ids(vectors_array, ids_array)
+            source_files = {item["source_file"] for item in metadata}
+            with self._writing():
+                docs = self.documents.get(tenant, {})
+                removed_ids = [chunk_id for name in source_files for chunk_id in docs.get(name, ())]
+                self._write(removed_ids, np.array(vectors, dtype='float32'), metadata)
             # 返回信息
             success_ratio = len(vectors) / len(chunks)
             if success_ratio == 1:
-                st.session_state.rag_faiss_index = index
-                st.session_state.rag_meta_data = metadata
                 return 'success', None, '全部获取完毕'
             else:
                 return 'success', None, f'获取成功率为{int(success_ratio * 100)}%，失败信息有{error_msg_list}'
         else:
             return 'failed', None, f'全部获取失败，失败信息有{error_msg_list}'
 
-    @staticmethod
+    def remove_document(self, tenant: str, source_file: str) -> bool:
+        """按文档删除知识块，只追加一行日志，索引里的向量在下一个检查点删除"""
+        with self._writing():
+            removed_ids = self.documents.get(tenant, {}).get(source_file)
+            if not removed_ids:
+                return False
+            self._write(list(removed_ids), np.empty((0, EMBEDDING_DIM), dtype='float32'), [])
+        return True
+
+    def _visible_rows(self, tenant: Optional[str], topic: Optional[str], include_public: bool) -> Optional[np.ndarray]:
+        """按标签算出可检索的向量行号，None表示全部可见"""
+        if tenant is None and topic is None:
+            return None
+        if tenant is None:
+            tenants = list(self.documents)
+        else:
+            tenants = [tenant] + ([PUBLIC_TENANT] if include_public and tenant != PUBLIC_TENANT else [])
+        if topic is None:
+            parts = [self.tenant_rows.get(t) for t in tenants]
+        else:
+            parts = [self.topic_rows.get((t, topic)) for t in tenants]
+        parts = [rows for rows in parts if rows is not None]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=int)
+
+    def visible_count(self, tenant: Optional[str], topic: Optional[str] = None, include_public: bool = True) -> int:
+        """租户可检索的知识块数，范围同search"""
+        with self._lock:
+            rows = self._visible_rows(tenant, topic, include_public)
+            return len(self.meta_map) if rows is None else len(rows)
+
+    def _snapshot(self) -> tuple:
+        """向量检索用到的状态，在锁内一次取出，检索期间其他线程的写入不影响这一次检索"""
+        with self._lock:
+            return self.index, self.vectors, self.ids, self.row_of, self.delta_rows, self._tombstones
+
     def search(
+            self,
             query: str,
             k: int,
-            embedding_fn=netease_youdao_embedding,
+            tenant: Optional[str] = None,
+            topic: Optional[str] = None,
+            include_public: bool = True,
+            embedding_fn: EmbeddingBackend = None,
+            deadline: float = EMBEDDING_DEADLINE,
     ) -> List[Dict]:
         """
         多场景检索：
-        1. 指定user_name和topic：精确检索用户某主题
-        2. 仅指定user_name：检索用户所有文档
+        1. 指定tenant和topic：精确检索用户某主题（默认连同公共研报的该主题）
+        2. 仅指定tenant：检索用户所有文档（默认连同公共研报）
         3. 都不指定：全局检索（需管理员权限）
+        BM25词法结果与向量结果按倒数排序融合，score越大越相关；
+        查询向量在deadline秒内拿不到（超时、接口报错）时只用词法结果作答，两路都没有结果才报错。
+        """
+        return self.search_many([query], k, tenant, topic, include_public, embedding_fn, deadline)[0]
+
+    def search_many(
+            self,
+            queries: List[str],
+            k: int,
+            tenant: Optional[str] = None,
+            topic: Optional[str] = None,
+            include_public: bool = True,
+            embedding_fn: EmbeddingBackend = None,
+            deadline: float = EMBEDDING_DEADLINE,
+    ) -> List[List[Dict]]:
+        """批量检索：所有查询合并成一次向量化请求、一次index.search，返回与queries一一对应的结果，范围同search
+
+        重复的查询只算一次，每条查询的结果内知识块不重复。
+        """
+        unique = list(dict.fromkeys(queries))
+        # 向量接口与本地词法检索并行，词法检索不需要网络请求
+        future = _query_executor.submit(embed_queries, unique, embedding_fn)
+        with self._lock:
+            lexical, ids = self.lexical, self.ids
+            rows = self._visible_rows(tenant, topic, include_public)
+            snapshot = self._snapshot()
+        if rows is not None and len(rows) == 0:
+            future.cancel()
+            return [[] for _ in queries]
+        allowed = None if rows is None else ids[rows]
+        fetch = k * CANDIDATE_MULTIPLIER
+        lexical_ids = [[chunk_id for chunk_id, _ in lexical.search(query, fetch, allowed)] for query in unique]
+        try:
+            embeddings = future.result(timeout=deadline)
+        except TimeoutError:
+            embeddings = [('failed', None, f'超过{deadline}秒未返回')] * len(unique)
+        except Exception as e:
+            embeddings = [('failed', None, repr(e))] * len(unique)
+
+        embedded = [i for i, (status, _, _) in enumerate(embeddings) if status != 'failed']
+        vector_ids = [[] for _ in unique]
+        if embedded:
+            query_embs = np.stack([embeddings[i][1] for i in embedded])
+            for i, found in zip(embedded, self._vector_search(query_embs, fetch, rows, *snapshot)):
+                vector_ids[i] = found
+        elif not any(lexical_ids):
+            raise ValueError(f"Embedding失败: {embeddings[0][2]}")
+        fused = [rrf_fuse(vector_ids[n], lexical_ids[n]) for n in range(len(unique))]
+        # 检索期间其他线程可能删除了候选知识块，在锁内一次取出结果用到的metadata，已删除的跳过
+        with self._lock:
+            items = {i: self.meta_map.get(i) for ranking in fused for i, _ in ranking}
+        results = {
+            query: [{
+                "text": items[i]["text"],
+                "score": score,
+                "source": items[i]["source_file"],
+            } for i, score in ranking if items[i] is not None][:k]
+            for query, ranking in zip(unique, fused)
+        }
+        return [results[query] for query in queries]
+
+    def _vector_search(self, query_embs: np.ndarray, k: int, rows: Optional[np.ndarray], index: Optional[faiss.Index],
+                       vectors: np.ndarray, ids: np.ndarray, row_of: Dict[int, int], delta_rows: np.ndarray,
+                       tombstones: frozenset) -> List[List[int]]:
+        """多条查询的向量检索，返回每条查询的chunk_id列表
+
+        索引只包含检查点里的知识块，还没并入索引的知识块在原始向量上精确计算，两路候选合并后再精确排序。
         """
-        if st.session_state.rag_meta_data == []:
+        normalized = is_normalized(index) if index is not None else self.storage != "float32"
+        if rows is not None and len(rows) <= EXACT_SEARCH_MAX:
+            # 可见的知识块少（典型的是单个用户的私有文档），直接在原始向量上精确计算
+            return [[int(i) for i in ids[ranked[:k]]] for ranked in exact_rank(query_embs, rows, vectors, normalized)]
+        delta = delta_rows if rows is None else np.intersect1d(delta_rows, rows)
+        if len(delta):
+            delta_ranked = exact_rank(query_embs, delta, vectors, normalized)[:, :k]
+        else:
+            delta_ranked = np.empty((len(query_embs), 0), dtype=np.int64)
+        if index is None or index.ntotal == 0:
+            return [[int(i) for i in ids[ranked]] for ranked in delta_ranked]
+        rerank = self.rerank and storage_of(index) != "float32"
+        fetch = k * RERANK_MULTIPLIER if rerank else k
+        if rows is not None:
+            params = search_params(index, ids[rows])
+        elif tombstones:
+            params = search_params(index, np.fromiter(tombstones, dtype=np.int64, count=len(tombstones)), exclude=True)
+        else:
+            params = None
+        _, I = index.search(normalize(query_embs) if normalized else query_embs, fetch, params=params)
+        results = []
+        for query_emb, found, delta_found in zip(query_embs, I, delta_ranked):
+            found = found[found >= 0]
+            if rerank or len(delta_found):
+                # 每条查询的候选不同，逐条在原始向量上重排；检索期间被删除的知识块不在row_of里，直接跳过
+                candidates = np.array([row_of[i] for i in found.tolist() if i in row_of] + delta_found.tolist(),
+                                      dtype=np.int64)
+                found = ids[exact_rank(query_emb, candidates, vectors, normalized)[0]] if len(candidates) else found
+            results.append([int(i) for i in found[:k]])
+        return results
+
+    def import_legacy(self, legacy_root: str = KNOWLEDGE_BASE_ROOT):
+        """把旧版本按用户分目录的知识库并入共享知识库，迁移完的目录加上.migrated后缀"""
+        if not os.path.isdir(legacy_root):
+            return
+        for name in sorted(os.listdir(legacy_root)):
+            legacy_dir = os.path.join(legacy_root, name)
+            meta_path = os.path.join(legacy_dir, "meta.json")
+            if name.endswith(".migrated") or not os.path.exists(meta_path):
+                continue
+            with open(meta_path, encoding="utf-8") as f:
+                legacy = json.load(f)
+            metadata = [dict(item, tenant=legacy["username"], topic=DEFAULT_TOPIC) for item in legacy["metadata"]]
+            vectors = _legacy_vectors(legacy_dir, metadata)
+            with self._writing():
+                if metadata and metadata[0]["chunk_id"] not in self.meta_map:  # 上次迁移中途退出时不重复导入
+                    self._write([], vectors, metadata)
+            os.replace(legacy_dir, f"{legacy_dir}.migrated")
+
+
+def _legacy_vectors(legacy_dir: str, metadata: List[Dict]) -> np.ndarray:
+    """旧版本知识库的向量：有向量文件直接读取，更早的版本从flat索引中还原"""
+    vectors_path = os.path.join(legacy_dir, "vectors.npy")
+    if os.path.exists(vectors_path):
+        return np.load(vectors_path)
+    index_path = os.path.join(legacy_dir, "index.faiss")
+    if not metadata or not os.path.exists(index_path):
+        return np.empty((0, EMBEDDING_DIM), dtype='float32')
+    index = faiss.read_index(index_path)
+    rows = {chunk_id: row for row, chunk_id in enumerate(faiss.vector_to_array(index.id_map))}
+    stored = faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    return stored[[rows[item["chunk_id"]] for item in metadata]]
+
+
+@func.lru_cache(maxsize=1)
+def get_shared_knowledge_base() -> SharedKnowledgeBase:
+    """进程内共享的知识库，首次加载时迁移旧版本的用户知识库"""
+    kb = SharedKnowledgeBase()
+    kb.import_legacy()
+    return kb
+
+
+class UserKnowledgeBase:
+    """用户在共享知识库上的视图：只能看到、增删自己的文档，检索时默认连同公共研报"""
+
+    def __init__(self, username: str, shared: SharedKnowledgeBase = None):
+        self.username = username
+        self.shared = shared or get_shared_knowledge_base()
+
+    @property
+    def documents(self) -> Dict[str, List[int]]:
+        return self.shared.documents.get(self.username, {})
+
+    @property
+    def metadata(self) -> List[Dict]:
+        return self.shared.tenant_metadata(self.username)
+
+    def __len__(self):
+        """用户自己上传的知识块数"""
+        return len(self.shared.tenant_rows.get(self.username, ()))
+
+    def visible_count(self, include_public: bool = True) -> int:
+        """检索时可见的知识块数，包括公共研报；用户没有上传过文档时也可能不为0"""
+        return self.shared.visible_count(self.username, include_public=include_public)
+
+    def add_document(self, chunks: List[Dict], embedding_fn: EmbeddingBackend = None, topic: str = DEFAULT_TOPIC,
+                     progress: Callable[[float], None] = None):
+        return self.shared.add_document(chunks, self.username, topic, embedding_fn, progress)
+
+    def remove_document(self, source_file: str) -> bool:
+        return self.shared.remove_document(self.username, source_file)
+
+    def find_document(self, digest: str) -> Optional[str]:
+        """按内容哈希查找用户已入库的文档，返回其文件名"""
+        for item in self.metadata:
+            if item.get("content_hash") == digest:
+                return item["source_file"]
+        return None
+
+    def search(
+            self,
+            query: str,
+            k: int,
+            topic: Optional[str] = None,
+            include_public: bool = True,
+            embedding_fn: EmbeddingBackend = None,
+            deadline: float = EMBEDDING_DEADLINE,
+    ) -> List[Dict]:
+        if self.visible_count(include_public) == 0:
             st.error('当前无知识保存，请到“知识库管理”上传知识')
             st.stop()
+        return self.shared.search(query, k, self.username, topic, include_public, embedding_fn, deadline)
+
+    def search_many(
+            self,
+            queries: List[str],
+            k: int,
+            topic: Optional[str] = None,
+            include_public: bool = True,
+            embedding_fn: EmbeddingBackend = None,
+            deadline: float = EMBEDDING_DEADLINE,
+    ) -> List[List[Dict]]:
+        """批量检索，如同时分析多只股票或同一问题的多种问法，成本接近单次检索"""
+        if self.visible_count(include_public) == 0:
+            st.error('当前无知识保存，请到“知识库管理”上传知识')
+            st.stop()
+        return self.shared.search_many(queries, k, self.username, topic, include_public, embedding_fn, deadline)
+
 
-        # 生成查询向量
-        status, query_emb, msg = embedding_fn(query)
-        if status == 'failed':
-            raise ValueError(f"Embedding失败: {msg}")
-        index:faiss.IndexIDMap = st.session_state.rag_faiss_index
-        status, query_emb, _ = embedding_fn(query)
-        D, I = index.search(
-            np.array([query_emb], dtype='float32'), k
-        )
-        metadata = st.session_state.rag_meta_data
-        metaid2content = {i['chunk_id']: i for i in metadata}
-        return [{
-            "text": metaid2content[i]["text"],
-            "score": float(D[0][j]),
-            "source": metaid2content[i]["source_file"],
-        } for j, i in enumerate(I[0]) if i >= 0]
\ No newline at end of file
+def get_user_knowledge_base(username: str) -> UserKnowledgeBase:
+    """按用户名获取其在共享知识库上的视图"""
+    shared = get_shared_knowledge_base()
+    shared.refresh()
+    return UserKnowledgeBase(username, shared)
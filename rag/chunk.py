@@ -1,58 +1,179 @@
+"""文档解析与切块
+
+按生成器流式处理：PDF按页段提交到进程池解析，文本一边到达一边切块，
+调用方拿够需要的块数后停止迭代，剩余页面不再解析，整篇文本也不会同时驻留内存。
+"""
+import os
+import codecs
 import hashlib
-from datetime import datetime
-from typing import List, Dict, Union, BinaryIO
+import tempfile
+import threading
+import multiprocessing
+from typing import Dict, List, Union, BinaryIO, Iterator, Optional
 from pathlib import Path
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+from cachetools import func
 
-def chunk_document(file_stream: Union[BinaryIO, bytes], file_name: str, chunk_size=600, overlap=100) -> \
-List[Dict]:
-    """处理文件流并返回分块结果"""
-    # 根据文件扩展名选择解析器
-    ext = Path(file_name).suffix.lower()
-    text = ""
+PDF_WORKERS = 2  # PDF解析进程数
+PDF_PAGES_PER_TASK = 4  # 每个解析任务的页数
+TXT_READ_SIZE = 64 * 1024  # txt每次读取的字节数
 
-    if ext == '.pdf':
+
+def _extract_pdf_pages(path: str, start: int, stop: int) -> List[str]:
+    """在解析进程中抽取[start, stop)页的文字，扫描页等无文字的页面返回空串"""
+    import pdfplumber
+
+    # pages参数（从1开始）让pdfplumber只解析需要的页面
+    with pdfplumber.open(path, pages=range(start + 1, stop + 1)) as pdf:
+        return [(page.extract_text() or "") for page in pdf.pages]
+
+
+class PdfParser:
+    """有界进程池解析PDF，按页段并发、按顺序产出"""
+
+    def __init__(self, max_workers: int = PDF_WORKERS):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def iter_pages(self, data: bytes, pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[str]:
         import pdfplumber
-        text = ''
-        if isinstance(file_stream, bytes):
-            import io
-            file_stream = io.BytesIO(file_stream)
 
-        with pdfplumber.open(file_stream) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text()
+        # 解析进程通过临时文件读取PDF，避免每个任务都序列化一遍整个文件
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        pending = deque()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            with pdfplumber.open(path) as pdf:
+                n_pages = len(pdf.pages)
+            if n_pages <= pages_per_task:  # 页数少时不值得跨进程
+                yield from _extract_pdf_pages(path, 0, n_pages)
+                return
+
+            pool = self._get_pool()
+            starts = iter(range(0, n_pages, pages_per_task))
+            # 只预取有限的页段，调用方提前停止时未开始的任务会被取消
+            for start in starts:
+                pending.append(pool.submit(_extract_pdf_pages, path, start, start + pages_per_task))
+                if len(pending) >= self.max_workers * 2:
+                    break
+            while pending:
+                pages = pending.popleft().result()
+                start = next(starts, None)
+                if start is not None:
+                    pending.append(pool.submit(_extract_pdf_pages, path, start, start + pages_per_task))
+                yield from pages
+        finally:
+            for future in pending:
+                future.cancel()
+            for future in pending:  # 已开始的任务结束后再删除临时文件
+                if not future.cancelled():
+                    future.exception()
+            os.remove(path)
+
+
+@func.lru_cache(maxsize=1)
+def get_pdf_parser() -> PdfParser:
+    """进程内共享的PDF解析器"""
+    return PdfParser()
+
+
+def _read_bytes(file_stream: Union[BinaryIO, bytes]) -> bytes:
+    if isinstance(file_stream, bytes):
+        return file_stream
+    if hasattr(file_stream, "getvalue"):  # BytesIO、Streamlit的UploadedFile不需要再复制一遍
+        return file_stream.getvalue()
+    return file_stream.read()
+
+
+def iter_text(file_stream: Union[BinaryIO, bytes], file_name: str) -> Iterator[str]:
+    """按文件类型逐段产出文本：PDF按页，docx按段落，txt按块"""
+    ext = Path(file_name).suffix.lower()
+
+    # 各页、各段落之间的拼接方式与整篇解析时保持一致，切出的知识块不变，已有的向量缓存仍然命中
+    if ext == '.pdf':
+        yield from get_pdf_parser().iter_pages(_read_bytes(file_stream))
 
     elif ext == '.docx':
+        import io
+
         from docx import Document
         if isinstance(file_stream, bytes):
-            import io
             file_stream = io.BytesIO(file_stream)
 
-        text = "\n".join([para.text for para in Document(file_stream).paragraphs])
+        for i, para in enumerate(Document(file_stream).paragraphs):
+            yield para.text if i == 0 else "\n" + para.text
 
     elif ext == '.txt':
+        import io
         if isinstance(file_stream, bytes):
-            text = file_stream.decode('utf-8')
-        else:
-            text = file_stream.read().decode('utf-8')
+            file_stream = io.BytesIO(file_stream)
+
+        decoder = codecs.getincrementaldecoder('utf-8')()  # 多字节字符可能跨块
+        while block := file_stream.read(TXT_READ_SIZE):
+            yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
 
     else:
         raise ValueError(f"不支持的文件类型: {ext}")
 
-    # 分块处理
-    chunks = []
-    for i in range(0, len(text), chunk_size - overlap):
-        chunk = text[i:i + chunk_size]
-        chunk_id = hashlib.md5(f"{file_name}_{i}".encode()).hexdigest()
 
-        chunks.append({
-            "id": chunk_id,
-            "text": chunk,
+def iter_chunks(file_stream: Union[BinaryIO, bytes], file_name: str, chunk_size=600, overlap=100,
+                max_chunks: Optional[int] = None) -> Iterator[Dict]:
+    """流式切块，相邻块重叠overlap个字符；达到max_chunks后停止解析"""
+    step = chunk_size - overlap
+    pieces = iter_text(file_stream, file_name)
+    buffer, pos, offset = "", 0, 0  # buffer[pos]对应全文第offset个字符
+    count = 0
+
+    def make_chunk(i: int, text: str) -> Dict:
+        return {
+            "id": hashlib.md5(f"{file_name}_{i}".encode()).hexdigest(),
+            "text": text,
             "metadata": {
                 "chunk_index": i,
                 "source_file": file_name,  # 使用文件名而不是路径
                 "create_time": datetime.now().isoformat()
             }
-        })
+        }
+
+    try:
+        for piece in pieces:
+            buffer = buffer[pos:] + piece
+            pos = 0
+            while len(buffer) - pos >= chunk_size:
+                if max_chunks is not None and count >= max_chunks:
+                    return
+                yield make_chunk(offset, buffer[pos:pos + chunk_size])
+                count += 1
+                pos += step
+                offset += step
+        # 剩余不足一块的尾部
+        while pos < len(buffer):
+            if max_chunks is not None and count >= max_chunks:
+                return
+            yield make_chunk(offset, buffer[pos:pos + chunk_size])
+            count += 1
+            pos += step
+            offset += step
+    finally:
+        pieces.close()
 
-    return chunks
\ No newline at end of file
+
+def chunk_document(file_stream: Union[BinaryIO, bytes], file_name: str, chunk_size=600, overlap=100,
+                   max_chunks: Optional[int] = None) -> List[Dict]:
+    """处理文件流并返回分块结果"""
+    return list(iter_chunks(file_stream, file_name, chunk_size, overlap, max_chunks))
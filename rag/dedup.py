@@ -0,0 +1,67 @@
+"""入库前的近重复知识块去除
+
+券商研报每页都重复免责声明、页眉页脚，这些块各自向量化既浪费接口调用和索引内存，
+检索时还会挤掉有用的结果。这里用MinHash估计字符n-gram集合的Jaccard相似度，
+再用LSH分桶只比较可能相似的块，整体是线性复杂度。
+"""
+import zlib
+from typing import Dict, List, Tuple, Iterable, Iterator
+
+import numpy as np
+
+DEDUP_THRESHOLD = 0.8  # Jaccard相似度不低于该值视为重复
+SHINGLE_SIZE = 5  # 字符n-gram长度，中文不需要分词
+NUM_PERM = 64
+LSH_BANDS = 16  # 每段4个哈希，相似度约0.5以上的块大概率落入同一个桶
+
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 1 << 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)  # multiply-shift哈希要求a为奇数
+_B = _rng.integers(0, 1 << 63, NUM_PERM, dtype=np.uint64)
+
+
+def minhash(text: str, shingle_size: int = SHINGLE_SIZE) -> np.ndarray:
+    """文本的MinHash签名，空白字符不参与比较"""
+    text = "".join(text.split())
+    shingles = {text[i:i + shingle_size] for i in range(max(len(text) - shingle_size + 1, 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    with np.errstate(over="ignore"):  # uint64乘法按2^64取模正是multiply-shift哈希需要的
+        permuted = (hashes[:, None] * _A + _B) >> np.uint64(32)
+    return permuted.min(axis=0)
+
+
+class NearDuplicateFilter:
+    """流式去重：依次判断每个块是否与之前保留的块近似重复，dropped记录节省的向量化次数"""
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+        self.kept = 0
+        self.dropped = 0
+
+    def is_duplicate(self, text: str) -> bool:
+        """是重复块返回True；否则记入已保留的块并返回False"""
+        signature = minhash(text)
+        keys = [band.tobytes() for band in np.split(signature, self.bands)]
+        candidates = {i for bucket, key in zip(self._buckets, keys) for i in bucket.get(key, ())}
+        if any(np.mean(self._signatures[i] == signature) >= self.threshold for i in candidates):
+            self.dropped += 1
+            return True
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(len(self._signatures))
+        self._signatures.append(signature)
+        self.kept += 1
+        return False
+
+    def filter(self, chunks: Iterable[Dict]) -> Iterator[Dict]:
+        for chunk in chunks:
+            if not self.is_duplicate(chunk["text"]):
+                yield chunk
+
+
+def dedup_chunks(chunks: Iterable[Dict], threshold: float = DEDUP_THRESHOLD) -> Tuple[List[Dict], int]:
+    """去除近重复块，返回保留的块和去掉的块数（即节省的向量化次数）"""
+    dedup = NearDuplicateFilter(threshold)
+    kept = list(dedup.filter(chunks))
+    return kept, dedup.dropped
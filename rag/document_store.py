@@ -0,0 +1,96 @@
+"""按内容哈希共享的文档解析结果
+
+同一份研报被许多用户上传（或同一用户改名后重复上传）时，按文件字节的sha256只解析、去重一次，
+之后直接复用保存的知识块文本；这些文本的向量由向量缓存按内容保存，同样全部署只请求一次。
+"""
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Tuple, Callable, Optional
+from datetime import datetime
+from contextlib import contextmanager
+
+from cachetools import func
+
+DOCUMENT_STORE_ROOT = "data/rag/documents"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class DocumentStore:
+    """content_hash -> 解析、去重后的知识块文本，按切块参数分别保存"""
+
+    def __init__(self, root: str = DOCUMENT_STORE_ROOT):
+        self.root = root
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, list] = {}  # key -> [锁, 等待和持有的线程数]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, key: str, parsed: Dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(parsed, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def locked(self, key: str):
+        """按key串行：同一份文件的多个入库任务排队执行，后面的任务直接命中解析结果和向量缓存"""
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def get_or_parse(self, digest: str, file_name: str, max_chunks: Optional[int],
+                     parse: Callable[[], Tuple[List[Dict], int]]) -> Tuple[List[Dict], int, bool]:
+        """返回(知识块, 去掉的重复块数, 是否复用)，没有解析过时调用parse并保存结果
+
+        调用方需持有locked(digest)，同一份文件的解析不会并发进行；没有读到文字的结果不保存，下次重新解析。
+        """
+        key = f"{digest}-{max_chunks or 'all'}"
+        parsed = self.get(key)
+        reused = parsed is not None
+        if not reused:
+            chunks, dropped = parse()
+            parsed = {"texts": [chunk["text"] for chunk in chunks],
+                      "chunk_indexes": [chunk["metadata"]["chunk_index"] for chunk in chunks],
+                      "dropped": dropped}
+            if chunks:
+                self.put(key, parsed)
+        create_time = datetime.now().isoformat()
+        chunks = [{
+            "text": text,
+            "metadata": {
+                "chunk_index": chunk_index,
+                "source_file": file_name,  # 同一份文件在不同用户处可以有不同的文件名
+                "create_time": create_time,
+                "content_hash": digest,
+            }
+        } for text, chunk_index in zip(parsed["texts"], parsed["chunk_indexes"])]
+        return chunks, parsed["dropped"], reused
+
+
+@func.lru_cache(maxsize=1)
+def get_document_store() -> DocumentStore:
+    """进程内共享的文档解析结果库"""
+    return DocumentStore()
@@ -1,19 +1,78 @@
+import threading
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from config import SILICON_FLOW_TOKEN
-def netease_youdao_embedding(text, SK_CODE=SILICON_FLOW_TOKEN):
+
+from config import SILICON_FLOW_TOKEN, SILICON_FLOW_BASE_URL
+
+EMBEDDING_MODEL = "netease-youdao/bce-embedding-base_v1"
+EMBEDDING_BATCH_SIZE = 32  # 单次请求的文本数
+EMBEDDING_MAX_WORKERS = 4  # 进程内同时进行的批次请求数
+
+_local = threading.local()
+# 进程内共享的批次请求线程池，线程常驻，各线程的Session和连接得以复用
+_batch_executor = ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS, thread_name_prefix="embedding-batch")
+
+
+def _session() -> requests.Session:
+    """每个线程一个Session，复用连接避免每次请求重新握手；requests.Session不保证线程安全，不跨线程共享"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _post_embeddings(texts, SK_CODE):
     headers = {
         "Authorization": f"Bearer {SK_CODE}",
         "Content-Type": "application/json"
     }
-    url = "https://api.siliconflow.cn/v1/embeddings"
+    url = f"{SILICON_FLOW_BASE_URL}/embeddings"
     payload = {
-        "model": "netease-youdao/bce-embedding-base_v1",
-        "input": text,
+        "model": EMBEDDING_MODEL,
+        "input": texts,
         "encoding_format": "float"
     }
-    response = requests.post(url, headers=headers, json=payload)
+    return _session().post(url, headers=headers, json=payload)
+
+
+def netease_youdao_embedding(text, SK_CODE=SILICON_FLOW_TOKEN):
+    response = _post_embeddings(text, SK_CODE)
     if response.status_code == 200:
         embedding = response.json()['data'][0]['embedding']
         return 'suceess', embedding, 'embedding成功'
     else:
-        return 'failed', 0, response.text
\ No newline at end of file
+        return 'failed', 0, response.text
+
+
+def _embedding_batch(texts: List[str], SK_CODE) -> List[Tuple]:
+    """一次请求获取一批文本的向量，整批失败时逐条重试"""
+    try:
+        response = _post_embeddings(texts, SK_CODE)
+        if response.status_code == 200:
+            embeddings = sorted(response.json()['data'], key=lambda item: item['index'])
+            return [('success', item['embedding'], 'embedding成功') for item in embeddings]
+    except requests.RequestException:
+        pass
+
+    results = []
+    for text in texts:
+        try:
+            results.append(netease_youdao_embedding(text, SK_CODE))
+        except requests.RequestException as e:
+            results.append(('failed', 0, str(e)))
+    return results
+
+
+def netease_youdao_embeddings(
+        texts: List[str],
+        SK_CODE=SILICON_FLOW_TOKEN,
+        batch_size=EMBEDDING_BATCH_SIZE,
+) -> List[Tuple]:
+    """批量获取向量：按batch_size分批，在共享线程池中并发请求，返回与texts一一对应的(status, embedding, msg)"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if len(batches) <= 1:
+        return [r for batch in batches for r in _embedding_batch(batch, SK_CODE)]
+    batch_results = _batch_executor.map(lambda batch: _embedding_batch(batch, SK_CODE), batches)
+    return [r for results in batch_results for r in results]
@@ -0,0 +1,154 @@
+"""向量化后端
+
+所有后端都是批量接口：backend(texts) -> 与texts一一对应的(status, embedding, msg)，
+可以直接作为UserKnowledgeBase的embedding_fn；model属性用作向量缓存的键，
+各后端的键不同，本地ONNX导出的向量与远程接口的向量在缓存里互不混用。
+
+- remote：SiliconFlow上的bce-embedding-base_v1
+- local：本地CPU运行同一模型的ONNX导出，需要额外安装onnxruntime和tokenizers
+- local_fallback：优先本地，本地失败的文本再走远程
+
+通过secrets中的EMBEDDING_BACKEND按部署选择。
+"""
+import os
+import abc
+import threading
+from typing import List, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from cachetools import func
+
+from config import EMBEDDING_BACKEND, LOCAL_EMBEDDING_MODEL_DIR
+from rag.embedding import EMBEDDING_MODEL, netease_youdao_embeddings
+from rag.embedding_cache import cached_embeddings
+
+LOCAL_EMBEDDING_THREADS = 4  # 本地推理线程数，每个线程跑一个批次
+LOCAL_EMBEDDING_BATCH_SIZE = 16
+LOCAL_MAX_LENGTH = 512
+
+
+class EmbeddingBackend(abc.ABC):
+    model: str  # 向量缓存的键，产出的向量不完全相同的后端不能共用
+
+    @abc.abstractmethod
+    def embed(self, texts: List[str]) -> List[Tuple]:
+        """非空的一批文本 -> 与texts一一对应的(status, embedding, msg)"""
+
+    def __call__(self, texts: List[str]) -> List[Tuple]:
+        return self.embed(texts) if texts else []
+
+    def cached(self, texts: List[str]) -> List[Tuple]:
+        """先查向量缓存，只对未命中的文本调用本后端"""
+        return cached_embeddings(texts, self, self.model)
+
+
+class RemoteEmbedding(EmbeddingBackend):
+    """远程接口，分批并发请求"""
+
+    model = EMBEDDING_MODEL
+
+    def embed(self, texts: List[str]) -> List[Tuple]:
+        return netease_youdao_embeddings(texts)
+
+
+class LocalOnnxEmbedding(EmbeddingBackend):
+    """本地CPU推理bce-embedding-base_v1的ONNX导出，取CLS向量并归一化，输出与远程接口同为768维
+
+    model_dir下需要有model.onnx和tokenizer.json，首次使用时才加载模型。
+    ONNX导出与远程接口的数值不完全一致，缓存键单独加上后缀。
+    """
+
+    model = f"{EMBEDDING_MODEL}@local-onnx"
+
+    def __init__(self, model_dir: str = LOCAL_EMBEDDING_MODEL_DIR, max_workers: int = LOCAL_EMBEDDING_THREADS):
+        self.model_dir = model_dir
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._session = None
+        self._tokenizer = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-embedding")
+
+    def _load(self):
+        with self._lock:
+            if self._session is None:
+                try:
+                    import onnxruntime
+                    from tokenizers import Tokenizer
+                except ImportError as e:
+                    raise ImportError("本地向量化需要安装onnxruntime和tokenizers") from e
+                tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                tokenizer.enable_truncation(LOCAL_MAX_LENGTH)
+                tokenizer.enable_padding()
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = 1  # 并行度由批次线程池控制，避免线程数相乘
+                self._session = onnxruntime.InferenceSession(
+                    os.path.join(self.model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+                )
+                self._tokenizer = tokenizer
+            return self._session, self._tokenizer
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        session, tokenizer = self._load()
+        encodings = tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        input_names = {i.name for i in session.get_inputs()}
+        hidden = session.run(None, {k: v for k, v in feeds.items() if k in input_names})[0]
+        cls = hidden[:, 0]
+        return cls / np.linalg.norm(cls, axis=1, keepdims=True)
+
+    def embed(self, texts: List[str]) -> List[Tuple]:
+        batches = [texts[i:i + LOCAL_EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), LOCAL_EMBEDDING_BATCH_SIZE)]
+        futures = [self._executor.submit(self._embed_batch, batch) for batch in batches]
+        results = []
+        for batch, future in zip(batches, futures):
+            try:
+                results.extend(('success', vector.tolist(), '本地embedding成功') for vector in future.result())
+            except Exception as e:
+                results.extend(('failed', 0, f'本地embedding失败: {e!r}') for _ in batch)
+        return results
+
+
+class FallbackEmbedding(EmbeddingBackend):
+    """主后端失败的文本交给备用后端重试
+
+    两个后端的向量分别按各自的model缓存，不会把备用后端的向量记在主后端名下。
+    """
+
+    def __init__(self, primary: EmbeddingBackend, fallback: EmbeddingBackend):
+        self.primary = primary
+        self.fallback = fallback
+        self.model = f"{primary.model}|{fallback.model}"
+
+    def _retry(self, texts: List[str], results: List[Tuple], backend: Callable) -> List[Tuple]:
+        failed = [i for i, (status, _, _) in enumerate(results) if status == 'failed']
+        if failed:
+            for i, result in zip(failed, backend([texts[i] for i in failed])):
+                results[i] = result
+        return results
+
+    def embed(self, texts: List[str]) -> List[Tuple]:
+        return self._retry(texts, self.primary(texts), self.fallback)
+
+    def cached(self, texts: List[str]) -> List[Tuple]:
+        return self._retry(texts, self.primary.cached(texts), self.fallback.cached)
+
+
+def make_embedding_backend(kind: str) -> EmbeddingBackend:
+    if kind == "remote":
+        return RemoteEmbedding()
+    if kind == "local":
+        return LocalOnnxEmbedding()
+    if kind == "local_fallback":
+        return FallbackEmbedding(LocalOnnxEmbedding(), RemoteEmbedding())
+    raise ValueError(f"不支持的向量化后端: {kind}")
+
+
+@func.lru_cache(maxsize=1)
+def get_embedding_backend() -> EmbeddingBackend:
+    """进程内共享的向量化后端，由secrets中的EMBEDDING_BACKEND决定"""
+    return make_embedding_backend(EMBEDDING_BACKEND)
@@ -0,0 +1,102 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from typing import List, Tuple, Callable, Optional
+
+import numpy as np
+from cachetools import func
+
+from rag.embedding import EMBEDDING_MODEL
+
+EMBEDDING_CACHE_ROOT = "data/rag/embedding_cache"
+EMBEDDING_DIM = 768
+
+
+class EmbeddingCache:
+    """按内容寻址的向量缓存：SQLite保存 hash(模型, 文本) -> 行号，向量追加写入float32矩阵文件并以内存映射读取"""
+
+    def __init__(self, root: str = EMBEDDING_CACHE_ROOT, dim: int = EMBEDDING_DIM):
+        os.makedirs(root, exist_ok=True)
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.db_path = os.path.join(root, "keys.sqlite")
+        self.matrix_path = os.path.join(root, "vectors.f32")
+        self._local = threading.local()
+        self._matrix = None
+        self._lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+        return conn
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _rows(self, max_row: int) -> np.ndarray:
+        """内存映射的向量矩阵，文件增长后重新映射"""
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[0] <= max_row:
+                rows = os.path.getsize(self.matrix_path) // self.row_bytes
+                self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            return self._matrix
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self.key(model, text) for text in texts]
+        found = {}
+        for i in range(0, len(keys), 500):  # SQLite单条语句的参数个数有限
+            batch = keys[i:i + 500]
+            sql = f"SELECT key, row FROM embeddings WHERE key IN ({','.join('?' * len(batch))})"
+            found.update(self._conn().execute(sql, batch).fetchall())
+        if not found:
+            return [None] * len(texts)
+        matrix = self._rows(max(found.values()))
+        return [np.array(matrix[found[k]]) if k in found else None for k in keys]
+
+    def put_many(self, model: str, texts: List[str], vectors: List):
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        conn = self._conn()
+        # IMMEDIATE事务同时作为跨进程写锁，保证行号与矩阵文件追加一致
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            start_row = os.path.getsize(self.matrix_path) // self.row_bytes if os.path.exists(self.matrix_path) else 0
+            with open(self.matrix_path, "ab") as f:
+                f.truncate(start_row * self.row_bytes)  # 丢弃上次异常中断留下的半行
+                f.write(vectors.tobytes())
+            rows = [(self.key(model, text), start_row + i) for i, text in enumerate(texts)]
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, row) VALUES (?, ?)", rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+@func.lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    """进程内共享的向量缓存"""
+    return EmbeddingCache()
+
+
+def cached_embeddings(texts: List[str], embedding_fn: Callable, model: str = EMBEDDING_MODEL) -> List[Tuple]:
+    """先查向量缓存，只对未命中的文本（去重后）调用embedding_fn，返回与texts一一对应的(status, embedding, msg)"""
+    cache = get_embedding_cache()
+    cached = cache.get_many(model, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    fetched = dict(zip(missing, embedding_fn(missing))) if missing else {}
+
+    ok_texts = [text for text, (status, _, _) in fetched.items() if status != 'failed']
+    cache.put_many(model, ok_texts, [fetched[text][1] for text in ok_texts])
+    return [
+        ('success', vector, '命中向量缓存') if vector is not None else fetched[text]
+        for text, vector in zip(texts, cached)
+    ]
@@ -0,0 +1,159 @@
+"""按语料规模选择FAISS索引类型
+
+- flat：暴力精确检索，小规模下最快也最准
+- hnsw：图索引，中等规模下延迟低、召回高，但不支持删除
+- ivfpq：倒排+乘积量化，需要训练，大规模下内存占用小
+
+storage为fp16或sq8时向量先做L2归一化、改用内积检索，flat和hnsw的向量分别以
+半精度或8位标量量化编码保存，内存约为float32的1/2和1/4；ivfpq本身已经压缩，只改用内积。
+"""
+import math
+
+import faiss
+import numpy as np
+
+FLAT_MAX_SIZE = 10_000  # 不超过该规模使用flat
+HNSW_MAX_SIZE = 200_000  # 不超过该规模使用hnsw，更大使用ivfpq
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVFPQ_M = 64  # 子空间个数，768维时每个子空间12维
+IVFPQ_NBITS = 8
+IVFPQ_NPROBE = 16
+STORAGES = ["float32", "fp16", "sq8"]
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def index_kind(size: int) -> str:
+    if size <= FLAT_MAX_SIZE:
+        return "flat"
+    if size <= HNSW_MAX_SIZE:
+        return "hnsw"
+    return "ivfpq"
+
+
+def _unwrap(index: faiss.Index) -> faiss.Index:
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+
+def kind_of(index: faiss.Index) -> str:
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+
+def is_normalized(index: faiss.Index) -> bool:
+    """压缩存储的索引使用内积，入库和检索的向量都需要先归一化"""
+    return index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12))
+
+
+def exact_rank(queries: np.ndarray, rows: np.ndarray, vectors: np.ndarray, normalized: bool) -> np.ndarray:
+    """在原始向量上精确计算，返回每条查询按相关度排序的行号（形状为查询数×行数）
+
+    度量与索引一致：归一化索引用余弦相似度，否则用L2距离；多条查询只做一次矩阵乘法。
+    """
+    rows = np.sort(rows)  # mmap按行号升序读取更快
+    candidates = np.asarray(vectors[rows], dtype="float32")
+    queries = np.asarray(queries, dtype="float32").reshape(-1, candidates.shape[1])
+    if normalized:
+        scores = -(normalize(queries) @ normalize(candidates).T)
+    else:
+        # |q-v|^2 = |q|^2 - 2q·v + |v|^2，|q|^2对排序无影响
+        scores = (candidates ** 2).sum(axis=1) - 2 * (queries @ candidates.T)
+    return rows[np.argsort(scores, axis=1)]
+
+
+def storage_of(index: faiss.Index) -> str:
+    """索引的向量存储方式，ivfpq只区分是否归一化"""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(inner, faiss.IndexIVF):
+        return "pq-ip" if is_normalized(index) else "pq-l2"
+    return "float32"
+
+
+def matches_storage(index: faiss.Index, storage: str) -> bool:
+    actual = storage_of(index)
+    if actual.startswith("pq-"):
+        return actual == ("pq-l2" if storage == "float32" else "pq-ip")
+    return actual == storage
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """hnsw不支持删除；IndexIDMap包装的ivf删除后id_map与倒排表里的内部编号错位，也不能删除"""
+    kind = kind_of(index)
+    return kind == "flat" or (kind == "ivfpq" and not isinstance(index, faiss.IndexIDMap))
+
+
+def tune(index: faiss.Index) -> faiss.Index:
+    """设置检索参数（加载后也需要调用）"""
+    kind = kind_of(index)
+    if kind == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = HNSW_EF_SEARCH
+    elif kind == "ivfpq":
+        faiss.extract_index_ivf(index).nprobe = IVFPQ_NPROBE
+    return index
+
+
+def build_index(vectors: np.ndarray, ids: np.ndarray, kind: str = None, storage: str = "float32") -> faiss.Index:
+    """用全部向量构建索引，kind为空时按规模自动选择；storage见模块说明"""
+    if storage not in STORAGES:
+        raise ValueError(f"不支持的向量存储方式: {storage}")
+    n, dim = vectors.shape
+    kind = kind or index_kind(n)
+    compact = storage != "float32"
+    metric = faiss.METRIC_INNER_PRODUCT if compact else faiss.METRIC_L2
+    vectors = normalize(vectors) if compact else np.ascontiguousarray(vectors, dtype="float32")
+    if kind == "flat":
+        inner = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[storage], metric) if compact else faiss.IndexFlatL2(dim)
+    elif kind == "hnsw":
+        if compact:
+            inner = faiss.IndexHNSWSQ(dim, _SQ_TYPES[storage], HNSW_M, metric)
+        else:
+            inner = faiss.IndexHNSWFlat(dim, HNSW_M)
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif kind == "ivfpq":
+        nlist = int(4 * math.sqrt(n))
+        quantizer = faiss.IndexFlatIP(dim) if compact else faiss.IndexFlatL2(dim)
+        inner = faiss.IndexIVFPQ(quantizer, dim, nlist, IVFPQ_M, IVFPQ_NBITS, metric)
+    else:
+        raise ValueError(f"不支持的索引类型: {kind}")
+    if not inner.is_trained and n:
+        # 训练样本最多取10万个（ivfpq约每个聚类中心64个点），足够且控制训练耗时
+        size = min(n, inner.nlist * 64 if kind == "ivfpq" else 100_000)
+        sample = vectors[np.random.default_rng(0).choice(n, size=size, replace=False)]
+        inner.train(sample)
+    # ivf的倒排表本身保存id，直接add_with_ids/remove_ids；其余类型用IndexIDMap映射chunk_id
+    index = inner if kind == "ivfpq" else faiss.IndexIDMap(inner)
+    if n:
+        index.add_with_ids(vectors, ids)
+    return tune(index)
+
+
+def search_params(index: faiss.Index, ids: np.ndarray, exclude: bool = False) -> faiss.SearchParameters:
+    """只检索ids中的向量，exclude为True时只检索ids以外的向量
+
+    显式带上检索参数，否则会用SearchParameters的默认值覆盖索引上的设置
+    """
+    sel = faiss.IDSelectorBatch(ids)
+    if exclude:
+        batch, sel = sel, faiss.IDSelectorNot(sel)
+        sel.referenced_objects = [batch]  # IDSelectorNot不持有内层选择器的引用
+    kind = kind_of(index)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=HNSW_EF_SEARCH)
+    if kind == "ivfpq":
+        return faiss.SearchParametersIVF(sel=sel, nprobe=IVFPQ_NPROBE)
+    return faiss.SearchParameters(sel=sel)
@@ -0,0 +1,124 @@
+"""知识库后台入库任务
+
+解析、去重、向量化都在后台线程池里完成，页面提交任务后立即返回任务ID，再按ID轮询状态和进度。
+解析结果按文件内容哈希在全部署共享，同一份研报只解析一次。
+入库完成时知识库的提交本身是原子的（一篇文档的增删是日志里的一行，在锁内一次应用到内存），
+检索方在任何时刻看到的要么是整篇文档都已入库，要么是都还没有入库。
+"""
+import threading
+from uuid import uuid4
+from typing import List, Optional
+from datetime import datetime
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache, func
+
+from rag.base import DEFAULT_TOPIC, get_user_knowledge_base
+from rag.chunk import iter_chunks
+from rag.dedup import NearDuplicateFilter
+from rag.document_store import content_hash, get_document_store
+
+INGEST_WORKERS = 2  # 同时进行的入库任务数，其余排队
+JOB_TTL = 3600  # 任务状态保留时长（秒）
+
+PARSE_SHARE = 0.3  # 进度条中解析阶段的占比，其余为向量化和提交
+
+
+class IngestJob:
+    """入库任务状态：status为queued / running / success / failed，progress取值0~1"""
+
+    def __init__(self, username: str, file_name: str):
+        self.id = uuid4().hex
+        self.username = username
+        self.file_name = file_name
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = '排队中...'
+        self.create_time = datetime.now()
+
+    def update(self, progress: float = None, message: str = None):
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('success', 'failed')
+
+
+class IngestionQueue:
+    """有界线程池执行入库任务，任务状态保留一段时间供页面查询"""
+
+    def __init__(self, max_workers: int = INGEST_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = TTLCache(maxsize=4096, ttl=JOB_TTL)
+        self._lock = threading.Lock()
+
+    def submit(self, username: str, data: bytes, file_name: str, max_chunks: Optional[int] = None,
+               topic: str = DEFAULT_TOPIC) -> str:
+        """提交入库任务，data为上传文件的完整字节，返回任务ID"""
+        job = IngestJob(username, file_name)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, data, max_chunks, topic)
+        return job.id
+
+    def get(self, job_id: Optional[str]) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def jobs_of(self, username: str) -> List[IngestJob]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.username == username]
+
+    @staticmethod
+    def _run(job: IngestJob, data: bytes, max_chunks: Optional[int], topic: str):
+        try:
+            job.status = 'running'
+            job.update(0.0, '正在解析文档...')
+            digest = content_hash(data)
+            store = get_document_store()
+            # 同一份文件的任务串行，先完成的任务解析和向量化之后，其余任务全部命中缓存
+            with store.locked(digest):
+                IngestionQueue._ingest(job, data, digest, max_chunks, topic)
+        except Exception as e:
+            job.update(1.0, f'入库失败：{e!r}')
+            job.status = 'failed'
+
+    @staticmethod
+    def _ingest(job: IngestJob, data: bytes, digest: str, max_chunks: Optional[int], topic: str):
+        def parse():
+            # 去掉每页重复的免责声明、页眉页脚等近重复块，只解析到凑够块数为止
+            dedup = NearDuplicateFilter()
+            chunks = []
+            for chunk in islice(dedup.filter(iter_chunks(data, job.file_name)), max_chunks):
+                chunks.append(chunk)
+                if max_chunks:
+                    job.update(PARSE_SHARE * len(chunks) / max_chunks)
+            return chunks, dedup.dropped
+
+        chunks, dropped, reused = get_document_store().get_or_parse(digest, job.file_name, max_chunks, parse)
+        if not chunks:
+            job.update(1.0, '未能从文档中读取到文字')
+            job.status = 'failed'
+            return
+
+        read_msg = f'读取到{len(chunks)}个知识块'
+        if reused:
+            read_msg = f'该文档已被解析过，直接复用{len(chunks)}个知识块'
+        if dropped:
+            read_msg += f'，跳过{dropped}个重复知识块，节省{dropped}次向量化'
+        job.update(PARSE_SHARE, f'{read_msg}，正在存入知识库...')
+        status, _, msg = get_user_knowledge_base(job.username).add_document(
+            chunks, topic=topic, progress=lambda p: job.update(PARSE_SHARE + (1 - PARSE_SHARE) * p * 0.95)
+        )
+        job.update(1.0, f'{read_msg}；{msg}')
+        job.status = status
+
+
+@func.lru_cache(maxsize=1)
+def get_ingestion_queue() -> IngestionQueue:
+    """进程内共享的入库任务队列"""
+    return IngestionQueue()
@@ -0,0 +1,222 @@
+"""知识块的本地词法索引（BM25）
+
+中文不分词，直接用相邻两个字（英文、数字按整词）作为检索单元。
+入库、删除时只增量更新涉及的知识块，倒排表是紧凑的numpy数组，随知识库一起以二进制持久化，检索不需要任何网络请求，
+既可以与向量检索的结果做排序融合，也可以在向量接口超时时单独兜底。
+"""
+import re
+import math
+import hashlib
+from typing import List, Tuple, Iterable, Optional
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # 倒数排序融合的平滑常数
+ALLOWED_LOOKUP_MAX = 4096  # 检索范围不超过这么多知识块时逐个查行号，否则对全部行做一次isin
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """中文按字二元组，英文和数字按整词；单字的中文片段保留单字"""
+    tokens = []
+    for piece in _TOKEN_RE.findall(text.lower()):
+        if not ("一" <= piece[0] <= "鿿") or len(piece) == 1:
+            tokens.append(piece)
+        else:
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    """词项的64位稳定哈希，倒排表只存哈希不存词表；几十万个词项下发生碰撞的概率可以忽略"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _segment(terms: np.ndarray, rows: np.ndarray, tfs: np.ndarray) -> tuple:
+    """(词项, 行号, 词频)三元组按词项排序成一个倒排段：(有序的词项哈希, 各词项的起止偏移, 行号, 词频)
+
+    排序是稳定的，同一词项内的行号保持升序。
+    """
+    order = np.argsort(terms, kind="stable")
+    terms, rows, tfs = terms[order], rows[order], tfs[order]
+    starts = np.flatnonzero(np.r_[True, terms[1:] != terms[:-1]]) if len(terms) else np.empty(0, dtype=np.int64)
+    return terms[starts], np.r_[starts, len(terms)].astype(np.int64), rows, tfs
+
+
+def _expand(segment: tuple) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """倒排段还原成(词项, 行号, 词频)三元组"""
+    terms, offsets, rows, tfs = segment
+    return np.repeat(terms, np.diff(offsets)), rows, tfs
+
+
+def _merge(segments: List[tuple]) -> tuple:
+    """按新旧顺序合并倒排段，旧段的行号更小，合并后同一词项内的行号仍然升序"""
+    triples = [_expand(segment) for segment in segments]
+    return _segment(*(np.concatenate(parts) for parts in zip(*triples)))
+
+
+class BM25Index:
+    """倒排表按段存放：每次add生成一个段，相邻两段大小接近时合并，段内行号和词频都是int32数组
+
+    行号对应ids中的chunk_id，remove把行标记为删除（ids中置为-1），检索时跳过；
+    删除的行由compacted()去掉，保存时也只写未删除的行。
+    全部数组只替换不原地修改，检索拿到的是一份一致的快照，不需要和写入加锁。
+    """
+
+    def __init__(self, ids: np.ndarray = None, doc_lens: np.ndarray = None, segments: List[tuple] = ()):
+        ids = np.empty(0, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        doc_lens = np.empty(0, dtype=np.int32) if doc_lens is None else np.asarray(doc_lens, dtype=np.int32)
+        alive = ids >= 0
+        self._state = (ids, doc_lens, tuple(segments), int(alive.sum()), int(doc_lens[alive].sum()))
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(ids.tolist()) if chunk_id >= 0}
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[int, str]]) -> "BM25Index":
+        docs = list(docs)
+        index = cls()
+        index.add([chunk_id for chunk_id, _ in docs], [text for _, text in docs])
+        return index
+
+    def __len__(self):
+        return self._state[3]
+
+    @property
+    def total_len(self) -> int:
+        return self._state[4]
+
+    @property
+    def dead(self) -> int:
+        """已删除但还占着行号的知识块数"""
+        return len(self._state[0]) - self._state[3]
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]):
+        """追加知识块，只为这些知识块生成一个新的倒排段；已在索引中的chunk_id跳过"""
+        old_ids, old_lens, segments, n, total_len = self._state
+        new_ids, new_lens, terms, rows, tfs = [], [], [], [], []
+        seen = set()
+        for chunk_id, text in zip(ids, texts):
+            if chunk_id in self.row_of or chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            tokens = tokenize(text)
+            row = len(old_ids) + len(new_ids)
+            new_ids.append(chunk_id)
+            new_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                terms.append(term_hash(term))
+                rows.append(row)
+                tfs.append(tf)
+        if not new_ids:
+            return
+        segments = list(segments)
+        segments.append(_segment(np.array(terms, dtype=np.int64), np.array(rows, dtype=np.int32),
+                                 np.array(tfs, dtype=np.int32)))
+        # 前一段不超过新段的两倍就合并，段数保持在对数级，每条倒排记录平均只被合并对数次
+        while len(segments) > 1 and len(segments[-2][2]) <= 2 * len(segments[-1][2]):
+            segments[-2:] = [_merge(segments[-2:])]
+        self._state = (np.concatenate([old_ids, np.array(new_ids, dtype=np.int64)]),
+                       np.concatenate([old_lens, np.array(new_lens, dtype=np.int32)]),
+                       tuple(segments), n + len(new_ids), total_len + sum(new_lens))
+        self.row_of.update((chunk_id, len(old_ids) + i) for i, chunk_id in enumerate(new_ids))
+
+    def remove(self, ids: Iterable[int]):
+        """删除知识块：只标记行号，不改动倒排表"""
+        rows = [row for row in (self.row_of.pop(chunk_id, None) for chunk_id in ids) if row is not None]
+        if not rows:
+            return
+        old_ids, doc_lens, segments, n, total_len = self._state
+        new_ids = old_ids.copy()
+        new_ids[rows] = -1
+        self._state = (new_ids, doc_lens, segments, n - len(rows), total_len - int(doc_lens[rows].sum()))
+
+    def compacted(self) -> "BM25Index":
+        """去掉已删除行、重新编号并合并成一个段的新索引，原索引不变，正在进行的检索不受影响"""
+        ids, doc_lens, segments, _, _ = self._state
+        alive = ids >= 0
+        new_row = (np.cumsum(alive) - 1).astype(np.int32)
+        if not segments:
+            return BM25Index(ids[alive], doc_lens[alive])
+        terms, rows, tfs = (np.concatenate(parts) for parts in zip(*(_expand(segment) for segment in segments)))
+        kept = alive[rows]
+        segment = _segment(terms[kept], new_row[rows[kept]], tfs[kept])
+        return BM25Index(ids[alive], doc_lens[alive], [segment] if len(segment[2]) else [])
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """返回得分最高的k个(chunk_id, BM25得分)，allowed（chunk_id数组）不为空时只对其中的知识块打分"""
+        ids, doc_lens, segments, n, total_len = self._state
+        if not n:
+            return []
+        allowed_rows = allowed_mask = None
+        if allowed is not None:
+            if len(allowed) > ALLOWED_LOOKUP_MAX:
+                allowed_mask = np.isin(ids, allowed)
+            else:
+                # 范围小时逐个查行号，再用二分只取倒排表里这些行；row_of可能领先于快照，用ids核对
+                rows = np.array([self.row_of.get(chunk_id, -1) for chunk_id in np.asarray(allowed).tolist()],
+                                dtype=np.int64)
+                rows = rows[(rows >= 0) & (rows < len(ids))]
+                allowed_rows = np.unique(rows[ids[rows] >= 0])
+            if not (allowed_rows is None or len(allowed_rows)):
+                return []
+        avg_len = total_len / n
+        hit_rows, hit_scores = [], []
+        for term, qtf in Counter(tokenize(query)).items():
+            h = term_hash(term)
+            postings = []
+            for terms, offsets, rows, tfs in segments:
+                i = np.searchsorted(terms, h)
+                if i < len(terms) and terms[i] == h:
+                    postings.append((rows[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]]))
+            df = sum(int((ids[rows] >= 0).sum()) for rows, _ in postings)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for rows, tfs in postings:
+                if allowed_rows is not None:
+                    pos = np.minimum(np.searchsorted(rows, allowed_rows), len(rows) - 1)
+                    keep = pos[rows[pos] == allowed_rows]
+                elif allowed_mask is not None:
+                    keep = np.flatnonzero(allowed_mask[rows])
+                else:
+                    keep = np.flatnonzero(ids[rows] >= 0)
+                rows, tf = rows[keep], tfs[keep].astype(np.float64)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens[rows] / avg_len)
+                hit_rows.append(rows)
+                hit_scores.append(qtf * idf * tf * (BM25_K1 + 1) / (tf + norm))
+        if not hit_rows:
+            return []
+        rows, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        top = np.lexsort((rows, -scores))[:k]
+        return [(int(ids[rows[i]]), float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        """以numpy二进制格式保存未删除的行和各倒排段"""
+        index = self.compacted() if self.dead else self
+        ids, doc_lens, segments, _, _ = index._state
+        arrays = {"ids": ids, "doc_lens": doc_lens}
+        for i, segment in enumerate(segments):
+            arrays.update(zip((f"terms{i}", f"offsets{i}", f"rows{i}", f"tfs{i}"), segment))
+        # 传文件对象，np.savez不会在.tmp路径后面再加.npz
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            segments = [tuple(data[f"{name}{i}"] for name in ("terms", "offsets", "rows", "tfs"))
+                        for i in range(sum(name.startswith("terms") for name in data.files))]
+            return cls(data["ids"], data["doc_lens"], segments)
+
+
+def rrf_fuse(*rankings: List[int], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """倒数排序融合：各路结果按名次打分1/(k+rank)后相加，不需要把不同量纲的分数归一化"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] += 1 / (k + rank + 1)
+    return scores.most_common()
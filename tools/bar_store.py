@@ -0,0 +1,290 @@
+import os
+import fcntl
+import threading
+from typing import List, Tuple
+from datetime import date, time, datetime, timedelta
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from cachetools import LRUCache, TTLCache, func
+
+from tools.trade_calendar import to_int_date, from_int_date, get_trading_calendar
+
+BAR_STORE_ROOT = "data/bars"
+DAILY_READY_TIME = time(17, 0)  # tushare当日日线一般在收盘后更新完毕，此时间之后才认为当日数据完整
+PARTIAL_TTL = 60  # 尚未完整的当日日线在这段时间（秒）内视为已覆盖，盘中的请求不必每次都访问tushare
+BAR_COLUMNS = ["order_book_id", "open", "close", "high", "low", "volume", "amount"]
+MIN_FREQUENCIES = ["1min", "5min", "15min", "30min", "60min"]
+MORNING_CLOSE = time(11, 30)
+
+_HDF_LOCK = threading.Lock()  # pytables不是线程安全的，所有HDF5读写串行
+
+
+def empty_bars(index_name: str) -> pd.DataFrame:
+    return pd.DataFrame(columns=BAR_COLUMNS, index=pd.DatetimeIndex([], name=index_name))
+
+
+def last_complete_day(now: datetime = None) -> date:
+    """最近一个日线数据已经完整的自然日"""
+    now = now or datetime.now()
+    if now.time() >= DAILY_READY_TIME:
+        return now.date()
+    return now.date() - timedelta(days=1)
+
+
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合并重叠或相邻（按自然日）的闭区间"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and to_int_date(from_int_date(merged[-1][1]) + timedelta(days=1)) >= start:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class DailyBarStore:
+    """按股票分文件的本地日线库（HDF5）
+
+    每个股票一个文件，包含两张表：
+    - bars: 以trade_date为索引的OHLCV数据
+    - coverage: 已经从tushare完整拉取过的日期闭区间，停牌日没有K线但也会被记为已覆盖，避免重复请求
+    """
+
+    def __init__(self, root: str = BAR_STORE_ROOT, max_resident: int = 512):
+        self.root = os.path.join(root, "daily")
+        os.makedirs(self.root, exist_ok=True)
+        self._resident = LRUCache(maxsize=max_resident)  # 热门股票常驻内存，毫秒级返回
+        self._partial = TTLCache(maxsize=4096, ttl=PARTIAL_TTL)  # order_book_id -> 最近拉取过的未完整区间
+        self._lock = threading.Lock()
+        self._symbol_locks = {}  # order_book_id -> 该股票的写锁
+
+    def _path(self, order_book_id: str) -> str:
+        return os.path.join(self.root, f"{order_book_id}.h5")
+
+    @contextmanager
+    def _writing(self, order_book_id: str):
+        """单只股票的写锁：进程内用线程锁，与其他进程（如夜间回补任务）之间用文件锁"""
+        with self._lock:
+            symbol_lock = self._symbol_locks.setdefault(order_book_id, threading.Lock())
+        with symbol_lock, open(f"{self._path(order_book_id)}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _coverage(self, order_book_id: str) -> List[Tuple[int, int]]:
+        """已覆盖的区间，加上短时间内拉取过、尚未完整的当日区间"""
+        _, coverage = self._load(order_book_id)
+        with self._lock:
+            partial = self._partial.get(order_book_id)
+        return merge_intervals(coverage + [partial]) if partial else coverage
+
+    def _load(self, order_book_id: str, fresh: bool = False):
+        """读取K线和已覆盖区间；fresh为True时不用常驻数据，直接读文件"""
+        path = self._path(order_book_id)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        with self._lock:
+            cached = None if fresh else self._resident.get(order_book_id)
+        # 文件可能被其他进程（如夜间回补任务）更新，以修改时间判断常驻数据是否过期
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        if mtime is not None:
+            with _HDF_LOCK:
+                bars = pd.read_hdf(path, "bars")
+                coverage_df = pd.read_hdf(path, "coverage")
+            coverage = list(coverage_df.itertuples(index=False, name=None))
+        else:
+            bars = empty_bars("trade_date")
+            coverage = []
+        with self._lock:
+            self._resident[order_book_id] = (mtime, bars, coverage)
+        return bars, coverage
+
+    def missing_ranges(self, order_book_id: str, start_date, end_date) -> List[Tuple[date, date]]:
+        """根据交易日历找出[start_date, end_date]中尚未覆盖的交易日区间"""
+        start, end = to_int_date(start_date), to_int_date(end_date)
+        coverage = self._coverage(order_book_id)
+        calendar = get_trading_calendar()
+        days = calendar.open_days_between(start_date, end_date)
+        covered = np.zeros(len(days), dtype=bool)
+        for cov_start, cov_end in coverage:
+            covered |= (days >= cov_start) & (days <= cov_end)
+
+        ranges = []
+        missing_idx = np.flatnonzero(~covered)
+        if len(missing_idx):
+            # 在交易日数组里下标连续的缺失日合并为一次请求
+            breaks = np.flatnonzero(np.diff(missing_idx) > 1)
+            run_starts = np.concatenate([[0], breaks + 1])
+            run_ends = np.concatenate([breaks, [len(missing_idx) - 1]])
+            for s, e in zip(run_starts, run_ends):
+                ranges.append((from_int_date(days[missing_idx[s]]), from_int_date(days[missing_idx[e]])))
+
+        # 超出交易日历范围的部分无法判断是否交易，整体视为缺失
+        if end > calendar.days[-1]:
+            tail_start = max(start, to_int_date(calendar.last_day + timedelta(days=1)))
+            if not any(cov_start <= tail_start and end <= cov_end for cov_start, cov_end in coverage):
+                ranges.append((from_int_date(tail_start), from_int_date(end)))
+        return ranges
+
+    def write(self, order_book_id: str, bars: pd.DataFrame, start_date, end_date):
+        """写入[start_date, end_date]区间拉取到的K线，并把该区间记为已覆盖
+
+        读取、合并、保存整个过程持有该股票的写锁，并在锁内重新读文件，并发写入同一只股票不会丢失其中一次。
+        """
+        with self._writing(order_book_id):
+            self._write(order_book_id, bars, start_date, end_date)
+
+    def _write(self, order_book_id: str, bars: pd.DataFrame, start_date, end_date):
+        old_bars, coverage = self._load(order_book_id, fresh=True)
+        if len(bars):
+            new_bars = pd.concat([old_bars, bars[BAR_COLUMNS]]) if len(old_bars) else bars[BAR_COLUMNS]
+            new_bars = new_bars[~new_bars.index.duplicated(keep="last")].sort_index()
+        else:
+            new_bars = old_bars
+
+        # 当日数据可能尚未更新完整，不能记为已覆盖
+        cov_end = min(to_int_date(end_date), to_int_date(last_complete_day()))
+        cov_start = to_int_date(start_date)
+        new_coverage = merge_intervals(coverage + [(cov_start, cov_end)]) if cov_start <= cov_end else coverage
+        if to_int_date(end_date) > cov_end:
+            partial_start = max(cov_start, to_int_date(last_complete_day() + timedelta(days=1)))
+            with self._lock:
+                self._partial[order_book_id] = (partial_start, to_int_date(end_date))
+
+        self._save(order_book_id, new_bars, new_coverage)
+
+    def write_cross_sections(self, bars: pd.DataFrame, start_date, end_date, universe=()):
+        """批量写入全市场截面数据，universe中当期没有K线的股票（停牌、未上市）同样记为已覆盖"""
+        groups = dict(tuple(bars.groupby("order_book_id", sort=False))) if len(bars) else {}
+        empty = empty_bars("trade_date")
+        for order_book_id in sorted(set(universe) | set(groups)):
+            self.write(order_book_id, groups.get(order_book_id, empty), start_date, end_date)
+
+    def _save(self, order_book_id: str, bars: pd.DataFrame, coverage: List[Tuple[int, int]]):
+        path = self._path(order_book_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        coverage_df = pd.DataFrame(coverage, columns=["start", "end"], dtype=np.int64)
+        bars = bars.astype({c: "float64" for c in BAR_COLUMNS if c != "order_book_id"})
+        bars.index.name = "trade_date"
+        with _HDF_LOCK:
+            bars.to_hdf(tmp_path, key="bars", mode="w", format="table")
+            coverage_df.to_hdf(tmp_path, key="coverage", mode="a", format="table")
+            os.replace(tmp_path, path)  # 原子替换，读者不会看到写了一半的文件
+            mtime = os.path.getmtime(path)
+        with self._lock:
+            self._resident[order_book_id] = (mtime, bars, coverage)
+
+    def read(self, order_book_id: str, start_date, end_date) -> pd.DataFrame:
+        bars, _ = self._load(order_book_id)
+        return bars.loc[pd.Timestamp(start_date) : pd.Timestamp(end_date)].copy()
+
+
+@func.lru_cache(maxsize=1)
+def get_daily_bar_store() -> DailyBarStore:
+    """进程内共享的日线库"""
+    return DailyBarStore()
+
+
+class MinuteBarStore:
+    """按股票、按交易日分区的本地1分钟线库（HDF5）
+
+    每个股票每个交易日只从tushare拉取一次1分钟线，其余频率都由本地重采样得到。
+    文件存在即表示该日已完整拉取，停牌日保存为空表。
+    """
+
+    def __init__(self, root: str = BAR_STORE_ROOT, max_resident: int = 256):
+        self.root = os.path.join(root, "min1")
+        self._resident = LRUCache(maxsize=max_resident)
+        self._lock = threading.Lock()
+
+    def _path(self, order_book_id: str, day: date) -> str:
+        return os.path.join(self.root, order_book_id, f"{day:%Y%m%d}.h5")
+
+    @staticmethod
+    def trading_days(start_date, end_date) -> List[date]:
+        """区间内的交易日，超出交易日历范围的部分按周一到周五估计（节假日拉到空表，落盘后不再请求）"""
+        start, end = to_int_date(start_date), to_int_date(end_date)
+        calendar = get_trading_calendar()
+        days = [from_int_date(d) for d in calendar.open_days_between(start_date, end_date)]
+        day = from_int_date(max(start, to_int_date(calendar.last_day + timedelta(days=1))))
+        while to_int_date(day) <= end:
+            if day.weekday() < 5:
+                days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def read_day(self, order_book_id: str, day: date):
+        """读取某日的1分钟线，本地没有时返回None"""
+        key = (order_book_id, day)
+        with self._lock:
+            cached = self._resident.get(key)
+        if cached is not None:
+            return cached
+
+        path = self._path(order_book_id, day)
+        if not os.path.exists(path):
+            return None
+        with _HDF_LOCK:
+            bars = pd.read_hdf(path, "bars")
+        with self._lock:
+            self._resident[key] = bars
+        return bars
+
+    def write_day(self, order_book_id: str, day: date, bars: pd.DataFrame):
+        """保存某日的1分钟线，当日未收盘完整的数据不落盘"""
+        if day > last_complete_day():
+            return
+        path = self._path(order_book_id, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        bars = bars[BAR_COLUMNS].astype({c: "float64" for c in BAR_COLUMNS if c != "order_book_id"})
+        bars.index.name = "trade_time"
+        with _HDF_LOCK:
+            bars.to_hdf(tmp_path, key="bars", mode="w", format="table")
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._resident[(order_book_id, day)] = bars
+
+
+@func.lru_cache(maxsize=1)
+def get_minute_bar_store() -> MinuteBarStore:
+    """进程内共享的分钟线库"""
+    return MinuteBarStore()
+
+
+def resample_min_bars(bars: pd.DataFrame, frequency: str) -> pd.DataFrame:
+    """把1分钟线向量化重采样为5/15/30/60分钟线
+
+    tushare分钟线以结束时刻为标签，09:30为集合竞价，并入第一根K线；
+    上午、下午分开重采样，保证60分钟线为10:30、11:30、14:00、15:00四根。
+    """
+    if frequency not in MIN_FREQUENCIES:
+        raise ValueError(f"不支持的分钟频率: {frequency}")
+    if frequency == "1min" or bars.empty:
+        return bars
+
+    index = bars.index
+    auction = (index.hour == 9) & (index.minute == 30)
+    bars = bars.set_axis(index.where(~auction, index + pd.Timedelta(minutes=1)))
+    morning = bars.index.time <= MORNING_CLOSE
+    agg = {
+        "order_book_id": "first",
+        "open": "first",
+        "close": "last",
+        "high": "max",
+        "low": "min",
+        "volume": "sum",
+        "amount": "sum",
+    }
+    parts = []
+    for mask, offset in ((morning, "30min" if frequency == "60min" else None), (~morning, None)):
+        part = bars[mask].resample(frequency, closed="right", label="right", offset=offset).agg(agg)
+        parts.append(part.dropna(subset=["open"]))
+    resampled = pd.concat(parts).sort_index()
+    resampled.index.name = index.name
+    return resampled
@@ -16,6 +16,14 @@ def get_client_ip():
     return remote_ip
 
 
+def get_session_user():
+    """当前会话的用户标识：登录用户用用户名，匿名用户用客户端IP，用于请求调度的公平排队"""
+    username = st.session_state.get("username")
+    if username:
+        return f"user:{username}"
+    return f"ip:{get_client_ip()}"
+
+
 def botton_callback(label: str, *args, **kwargs):
     username = st.session_state.get("username")
     ip = get_client_ip()
@@ -0,0 +1,100 @@
+import time
+import threading
+from typing import Hashable, Optional
+from collections import OrderedDict
+
+import pandas as pd
+from cachetools import func
+
+from tools.bar_store import last_complete_day
+
+CHART_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 缓存总大小上限
+CHART_CACHE_TTL = 10 * 60  # 默认过期时间（秒），当日数据可能还会更新
+CHART_CACHE_HISTORY_TTL = 24 * 60 * 60  # 历史区间的数据不会再变化，可以缓存更久
+
+
+def _sizeof(value: dict) -> int:
+    size = 0
+    for item in value.values():
+        if isinstance(item, (bytes, bytearray)):
+            size += len(item)
+        elif isinstance(item, pd.DataFrame):
+            size += int(item.memory_usage(index=True, deep=True).sum())
+    return size
+
+
+def chart_ttl(end_date) -> float:
+    """截止日期早于最近完整交易日的图表不会再变化，缓存更久"""
+    if pd.Timestamp(end_date).date() < last_complete_day():
+        return CHART_CACHE_HISTORY_TTL
+    return CHART_CACHE_TTL
+
+
+class ChartCache:
+    """跨会话共享的K线图缓存：LRU + TTL，按字节数淘汰
+
+    key 形如 (类型, 股票, 窗口/频率, 截止日期, 样式)，value 为 {"bars": DataFrame, "png": bytes}
+    """
+
+    def __init__(self, max_bytes: int = CHART_CACHE_MAX_BYTES, ttl: float = CHART_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (过期时间, 字节数, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def put(self, key: Hashable, value: dict, ttl: float = None):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        expire = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            self._items[key] = (expire, size, value)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._pop(next(iter(self._items)))
+                self.evictions += 1
+
+    def _pop(self, key: Hashable):
+        _, size, _ = self._items.pop(key)
+        self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._items),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+@func.lru_cache(maxsize=1)
+def get_chart_cache() -> ChartCache:
+    """进程内共享的K线图缓存"""
+    return ChartCache()
@@ -0,0 +1,193 @@
+"""K线图渲染服务
+
+mplfinance依赖pyplot全局状态，在Streamlit的多个脚本线程里直接调用并不安全，
+这里把渲染放到有上限的独立进程池中，每个进程使用Agg后端、显式持有并关闭figure。
+"""
+import ast
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from cachetools import func
+
+RENDER_WORKERS = 2  # 渲染进程数
+RENDER_MAX_PENDING = 8  # 排队中的渲染任务上限，超过时调用方阻塞等待
+RENDER_TIMEOUT = 60
+DEFAULT_ENGINE = "mplfinance"
+
+# 图表样式：up为阳线颜色，down为阴线颜色，figcolor/gridcolor为背景色
+STYLES = {
+    "default": {
+        "marketcolors": {"up": "r", "down": "g", "edge": "inherit", "wick": "inherit", "volume": "inherit"},
+        "figcolor": "(0.82, 0.83, 0.85)",
+        "gridcolor": "(0.82, 0.83, 0.85)",
+    },
+}
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render_mplfinance(df: pd.DataFrame, style: str) -> bytes:
+    import mplfinance as mpf
+    import matplotlib.pyplot as plt
+
+    style_kwargs = STYLES[style]
+    mpf_style = mpf.make_mpf_style(
+        marketcolors=mpf.make_marketcolors(**style_kwargs["marketcolors"]),
+        figcolor=style_kwargs["figcolor"],
+        gridcolor=style_kwargs["gridcolor"],
+    )
+    fig, _ = mpf.plot(df, style=mpf_style, type="candle", volume=True, returnfig=True)
+    try:
+        buffer = BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def _parse_color(color):
+    """兼容mplfinance样式里 "(0.82, 0.83, 0.85)" 这种字符串形式的RGB"""
+    if isinstance(color, str) and color.startswith("("):
+        return ast.literal_eval(color)
+    return color
+
+
+def _render_fast(df: pd.DataFrame, style: str) -> bytes:
+    """直接用matplotlib集合对象批量绘制蜡烛、影线和成交量，不经过mplfinance和pyplot"""
+    from matplotlib.figure import Figure
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    style_kwargs = STYLES[style]
+    up_color = style_kwargs["marketcolors"]["up"]
+    down_color = style_kwargs["marketcolors"]["down"]
+    grid_color = _parse_color(style_kwargs["gridcolor"])
+
+    opens = df["open"].to_numpy(dtype=float)
+    closes = df["close"].to_numpy(dtype=float)
+    highs = df["high"].to_numpy(dtype=float)
+    lows = df["low"].to_numpy(dtype=float)
+    volumes = df["volume"].to_numpy(dtype=float)
+    n = len(df)
+    x = np.arange(n, dtype=float)
+    colors = np.where(closes >= opens, up_color, down_color)
+
+    # 与mplfinance一致：蜡烛和成交量柱宽随K线数量收窄
+    body_width = 0.6 if n < 60 else 0.5 if n < 160 else 0.4
+    half = body_width / 2
+    bottoms = np.minimum(opens, closes)
+    tops = np.maximum(opens, closes)
+    tops = np.where(tops - bottoms == 0, bottoms + (highs.max() - lows.min()) * 1e-3, tops)  # 一字线至少画出一条细线
+    bodies = np.stack(
+        [
+            np.column_stack([x - half, bottoms]),
+            np.column_stack([x - half, tops]),
+            np.column_stack([x + half, tops]),
+            np.column_stack([x + half, bottoms]),
+        ],
+        axis=1,
+    )
+    wicks = np.stack([np.column_stack([x, lows]), np.column_stack([x, highs])], axis=1)
+    volume_bars = np.stack(
+        [
+            np.column_stack([x - half, np.zeros(n)]),
+            np.column_stack([x - half, volumes]),
+            np.column_stack([x + half, volumes]),
+            np.column_stack([x + half, np.zeros(n)]),
+        ],
+        axis=1,
+    )
+
+    fig = Figure(figsize=(8, 5.75), facecolor=_parse_color(style_kwargs["figcolor"]))
+    FigureCanvasAgg(fig)
+    price_ax = fig.add_axes([0.18, 0.38, 0.72, 0.5])
+    volume_ax = fig.add_axes([0.18, 0.18, 0.72, 0.2], sharex=price_ax)
+    price_ax.add_collection(LineCollection(wicks, colors=colors, linewidths=0.8))
+    price_ax.add_collection(PolyCollection(bodies, facecolors=colors, edgecolors=colors, linewidths=0.5))
+    volume_ax.add_collection(PolyCollection(volume_bars, facecolors=colors, edgecolors=colors, linewidths=0.5))
+
+    pad = (highs.max() - lows.min()) * 0.05 or 1
+    price_ax.set_xlim(-1, n)
+    price_ax.set_ylim(lows.min() - pad, highs.max() + pad)
+    volume_ax.set_ylim(0, volumes.max() * 1.1 or 1)
+    price_ax.set_ylabel("Price")
+    volume_ax.set_ylabel("Volume")
+    for ax in (price_ax, volume_ax):
+        ax.grid(True, color=grid_color)
+        ax.set_axisbelow(True)
+    price_ax.tick_params(labelbottom=False)
+
+    # 横轴按序号等距排列（跳过非交易时段），刻度标签取对应的时间
+    ticks = np.unique(np.linspace(0, n - 1, num=min(n, 7)).round().astype(int)) if n else []
+    intraday = n and (df.index.normalize() != df.index).any()
+    volume_ax.set_xticks(ticks)
+    volume_ax.set_xticklabels(df.index[ticks].strftime("%H:%M" if intraday else "%b %d"), rotation=45)
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+ENGINES = {
+    "mplfinance": _render_mplfinance,
+    "fast": _render_fast,
+}
+
+
+class RenderService:
+    """有界进程池渲染，调用方只拿到PNG字节"""
+
+    def __init__(self, max_workers: int = RENDER_WORKERS, max_pending: int = RENDER_MAX_PENDING):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def _reset_pool(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, fn, *args, timeout: float = RENDER_TIMEOUT) -> bytes:
+        with self._slots:
+            pool = self._get_pool()
+            try:
+                return pool.submit(fn, *args).result(timeout=timeout)
+            except BrokenProcessPool:  # 渲染进程异常退出时重建进程池再试一次
+                self._reset_pool(pool)
+                return self._get_pool().submit(fn, *args).result(timeout=timeout)
+
+
+@func.lru_cache(maxsize=1)
+def get_render_service() -> RenderService:
+    """进程内共享的渲染服务"""
+    return RenderService()
+
+
+def render_kline(df: pd.DataFrame, style: str = "default", engine: str = DEFAULT_ENGINE) -> bytes:
+    """渲染带成交量的蜡烛图，返回PNG字节；engine可选 mplfinance / fast"""
+    if style not in STYLES:
+        raise ValueError(f"不支持的图表样式: {style}")
+    if engine not in ENGINES:
+        raise ValueError(f"不支持的渲染引擎: {engine}")
+    return get_render_service().render(ENGINES[engine], df, style)
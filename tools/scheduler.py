@@ -0,0 +1,162 @@
+import time
+import hashlib
+import threading
+from typing import Dict, Tuple, Callable, Hashable, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from cachetools import func
+
+from config import TUSHARE_TOKEN
+
+PLATFORM_RATE_PER_MIN = 200  # 平台共享token的调用频率上限
+USER_RATE_PER_MIN = 500  # 用户自有token的调用频率上限
+MAX_CONCURRENT_CALLS = 8  # 同时进行中的tushare请求数
+
+
+class TokenBucket:
+    """令牌桶限流：rate_per_min为平均速率，burst为允许的瞬时突发量"""
+
+    def __init__(self, rate_per_min: float, burst: int = 10):
+        self.rate = rate_per_min / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """不阻塞地取一个令牌：取到返回0，否则返回还需等待的秒数"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        """令牌已攒满，此时丢弃这个桶再新建一个，限流效果不变"""
+        with self._lock:
+            self._refill()
+            return self.tokens >= self.capacity
+
+
+class FairQueue:
+    """按用户轮转的公平队列，避免单个用户的大量请求把其他用户饿死；由调用方加锁"""
+
+    def __init__(self):
+        self._users: "OrderedDict[Hashable, deque]" = OrderedDict()
+
+    def put(self, user: Hashable, item):
+        self._users.setdefault(user, deque()).append(item)
+
+    def pop(self):
+        """取出下一个请求，队列为空时返回None"""
+        if not self._users:
+            return None
+        user, items = self._users.popitem(last=False)
+        item = items.popleft()
+        if items:
+            self._users[user] = items  # 还有请求的用户排到队尾
+        return item
+
+    def __len__(self):
+        return sum(len(items) for items in self._users.values())
+
+
+class TushareScheduler:
+    """进程级tushare请求调度器
+
+    - 每个token一个令牌桶，平台token与用户自有token分别限流
+    - 同一token下相同的在途查询只发一次请求，结果共享（single-flight）
+    - 同一token下按用户公平排队，各token之间轮转
+    - 只有一个分发线程，没有排队请求且令牌已攒满的token随即释放，用户token再多也不会增加线程
+    """
+
+    def __init__(self, max_workers: int = MAX_CONCURRENT_CALLS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tushare")
+        self._lanes: "OrderedDict[str, Tuple[FairQueue, TokenBucket]]" = OrderedDict()  # token_key -> (队列, 令牌桶)
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Condition()
+        threading.Thread(target=self._dispatch, name="tushare-dispatch", daemon=True).start()
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+    def _lane(self, token: str) -> Tuple[FairQueue, TokenBucket]:
+        """调用方需持有self._lock"""
+        token_key = self._token_key(token)
+        lane = self._lanes.get(token_key)
+        if lane is None:
+            rate = PLATFORM_RATE_PER_MIN if token == TUSHARE_TOKEN else USER_RATE_PER_MIN
+            lane = self._lanes[token_key] = (FairQueue(), TokenBucket(rate))
+        return lane
+
+    def _next(self) -> Tuple[Optional[tuple], Optional[float]]:
+        """轮转各token取一个令牌可用的请求；都取不到时返回最短的等待秒数，None表示没有排队的请求"""
+        wait = None
+        for token_key, (queue, bucket) in list(self._lanes.items()):
+            if not len(queue):
+                if bucket.full:
+                    del self._lanes[token_key]
+                continue
+            token_wait = bucket.try_acquire()
+            if token_wait == 0:
+                self._lanes.move_to_end(token_key)  # 取到请求的token排到最后，各token轮流
+                return queue.pop(), None
+            wait = token_wait if wait is None else min(wait, token_wait)
+        return None, wait
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                item, wait = self._next()
+                if item is None:
+                    self._lock.wait(timeout=wait)  # 有新请求或令牌攒够时再取
+                    continue
+            self._executor.submit(self._run, *item)
+
+    @staticmethod
+    def _run(fn: Callable, future: Future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    def submit(self, token: str, user: Hashable, key: Hashable, fn: Callable) -> Future:
+        key = (self._token_key(token), key)  # 不同token的相同查询不合并，各自消耗自己的额度和权限
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:  # 已有相同查询在途，直接共享结果
+                return future
+            future = self._inflight[key] = Future()
+            queue, _ = self._lane(token)
+            queue.put(user, (fn, future))
+            self._lock.notify()
+        future.add_done_callback(lambda _: self._release(key))
+        return future
+
+    def _release(self, key: Hashable):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def call(self, token: str, user: Hashable, key: Hashable, fn: Callable, timeout: float = 120):
+        return self.submit(token, user, key, fn).result(timeout=timeout)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(queue) for queue, _ in self._lanes.values())
+
+
+@func.lru_cache(maxsize=1)
+def get_tushare_scheduler() -> TushareScheduler:
+    """进程内共享的tushare请求调度器"""
+    return TushareScheduler()
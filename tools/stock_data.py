@@ -1,20 +1,41 @@
-from datetime import datetime
-from cachetools import func
+from datetime import date, datetime
+from functools import partial
 
 import pandas as pd
 import tushare as ts
 
 from config import TUSHARE_TOKEN
+from tools.bar_store import empty_bars, resample_min_bars, get_daily_bar_store, get_minute_bar_store
+from tools.scheduler import get_tushare_scheduler
+from tools.symbol_table import get_symbol_table
 
-@func.lru_cache(maxsize=1)
-def load_stock_basic():
-    return pd.read_csv("data/stock_basic.csv")
 
 class StockData:
-    def __init__(self, source: str = "tushare", token: str = TUSHARE_TOKEN):
+    DAILY_NAME_MAP = {
+        "trade_date": "trade_date",
+        "ts_code": "order_book_id",
+        "open": "open",
+        "close": "close",
+        "high": "high",
+        "low": "low",
+        "vol": "volume",
+        "amount": "amount",
+    }
+
+    def __init__(self, source: str = "tushare", token: str = TUSHARE_TOKEN, user: str = "system"):
+        self.token = token
+        self.user = user  # 调度器按用户公平排队
         if source == "tushare":
             self.api = ts.pro_api(token)
 
+    def _query(self, api_name: str, **params):
+        """经进程级调度器限流、合并相同查询后调用tushare"""
+        key = (api_name, tuple(sorted(params.items())))
+        stock_df = get_tushare_scheduler().call(
+            self.token, self.user, key, partial(self.api.query, api_name, **params)
+        )
+        return stock_df.copy()  # 合并的查询共享同一个结果，各自拷贝后再修改
+
     def _daily_tushare(
         self, order_book_id: str, start_date: datetime, end_date: datetime
     ):
@@ -23,12 +44,39 @@ class StockData:
         end_dt = end_date.strftime("%Y%m%d")
 
         # 查询
-        stock_df = self.api.query(
+        stock_df = self._query(
             "daily", ts_code=order_book_id, start_date=start_dt, end_date=end_dt
         )
 
+        stock_df.rename(columns=self.DAILY_NAME_MAP, inplace=True)  # 重命名
+        stock_df = stock_df[list(self.DAILY_NAME_MAP.values())]  # 筛选列
+        return stock_df
+
+    def daily_cross_section(self, trade_date: date):
+        """某个交易日全市场的日线，一次请求返回所有股票"""
+        stock_df = self._query("daily", trade_date=trade_date.strftime("%Y%m%d"))
+        stock_df.rename(columns=self.DAILY_NAME_MAP, inplace=True)  # 重命名
+        stock_df = stock_df[list(self.DAILY_NAME_MAP.values())]  # 筛选列
+        return self._format_daily(stock_df)
+
+    def trade_cal(self, start_date: date, end_date: date):
+        """交易日历：https://tushare.pro/document/2?doc_id=26"""
+        return self._query(
+            "trade_cal", exchange="SSE", start_date=start_date.strftime("%Y%m%d"), end_date=end_date.strftime("%Y%m%d")
+        )
+
+    def _min_tushare(self, order_book_id: str, day: date):
+        # 参数格式修改，一次拉取整个交易日
+        start_dt = f"{day:%Y-%m-%d} 09:00:00"
+        end_dt = f"{day:%Y-%m-%d} 15:30:00"
+
+        # 查询：https://tushare.pro/document/2?doc_id=370
+        stock_df = self._query(
+            "stk_mins", ts_code=order_book_id, freq="1min", start_date=start_dt, end_date=end_dt
+        )
+
         name_map = {
-            "trade_date": "trade_date",
+            "trade_time": "trade_time",
             "ts_code": "order_book_id",
             "open": "open",
             "close": "close",
@@ -38,8 +86,10 @@ class StockData:
             "amount": "amount",
         }
 
-        stock_df.rename(columns=name_map, inplace=True)  # 重命名
-        stock_df = stock_df[list(name_map.values())]  # 筛选列
+        stock_df = stock_df.rename(columns=name_map).reindex(columns=list(name_map.values()))  # 重命名、筛选列
+        stock_df.set_index("trade_time", inplace=True)
+        stock_df.sort_index(inplace=True)
+        stock_df.index = pd.DatetimeIndex(stock_df.index)
         return stock_df
 
     @staticmethod
@@ -47,24 +97,45 @@ class StockData:
         if not order_book_id:
             raise ValueError("order_book_id is null")
 
-        stock_basic_df = load_stock_basic()
-        df_filter = order_book_id == stock_basic_df["ts_code"]
-        if not df_filter.any():
+        if order_book_id not in get_symbol_table():
             raise ValueError(f"not find the order_book_id {order_book_id}")
 
     def stock_info(self, order_book_id: str):
         """股票基本信息"""
         self.check_order_book_id(order_book_id)
-        stock_basic_df = load_stock_basic()
-        stock_info = stock_basic_df[order_book_id == stock_basic_df["ts_code"]].iloc[0]
-        return stock_info.to_dict()
+        return dict(get_symbol_table().get(order_book_id))
 
-    def daily(self, order_book_id: str, start_date: datetime, end_date: datetime):
-        """日度数据"""
-        self.check_order_book_id(order_book_id)
-        stock_df = self._daily_tushare(order_book_id, start_date, end_date)
-        stock_df.set_index("trade_date", inplace=True)
+    @staticmethod
+    def _format_daily(stock_df: pd.DataFrame):
+        stock_df = stock_df.set_index("trade_date")
         stock_df.sort_index(inplace=True)
         stock_df.index = pd.DatetimeIndex(stock_df.index)
-
         return stock_df
+
+    def daily(self, order_book_id: str, start_date: datetime, end_date: datetime):
+        """日度数据，优先读取本地日线库，只向tushare请求缺失的交易日区间"""
+        self.check_order_book_id(order_book_id)
+        store = get_daily_bar_store()
+        for gap_start, gap_end in store.missing_ranges(order_book_id, start_date, end_date):
+            stock_df = self._daily_tushare(order_book_id, gap_start, gap_end)
+            store.write(order_book_id, self._format_daily(stock_df), gap_start, gap_end)
+
+        return store.read(order_book_id, start_date, end_date)
+
+    def min(self, order_book_id: str, frequency: str, start_date: datetime, end_date: datetime):
+        """分钟数据，1分钟线按交易日缓存在本地，其余频率由1分钟线重采样得到"""
+        self.check_order_book_id(order_book_id)
+        store = get_minute_bar_store()
+        day_frames = []
+        for day in store.trading_days(start_date, end_date):
+            stock_df = store.read_day(order_book_id, day)
+            if stock_df is None:
+                stock_df = self._min_tushare(order_book_id, day)
+                store.write_day(order_book_id, day, stock_df)
+            day_frames.append(stock_df)
+
+        day_frames = [df for df in day_frames if len(df)]
+        if not day_frames:
+            return empty_bars("trade_time")
+        stock_df = pd.concat(day_frames).loc[pd.Timestamp(start_date) : pd.Timestamp(end_date)]
+        return resample_min_bars(stock_df, frequency)
@@ -0,0 +1,67 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+import pandas as pd
+from pypinyin import Style, lazy_pinyin
+from cachetools import func
+
+
+def pinyin_initials(name: str) -> str:
+    """股票名称的拼音首字母，如 平安银行 -> payh"""
+    return "".join(lazy_pinyin(name, style=Style.FIRST_LETTER)).lower()
+
+
+class SymbolTable:
+    """股票代码表：ts_code/symbol哈希索引 + 代码、名称、拼音首字母的前缀索引"""
+
+    def __init__(self, stock_basic_df: pd.DataFrame):
+        self.df = stock_basic_df
+        self.ts_codes: List[str] = stock_basic_df["ts_code"].tolist()
+        records = stock_basic_df.to_dict("records")
+        self._by_ts_code: Dict[str, dict] = {item["ts_code"]: item for item in records}
+        self._by_symbol: Dict[str, dict] = {str(item["symbol"]).zfill(6): item for item in records}
+
+        # 前缀索引：(检索键, ts_code)升序排列，前缀查询即二分定位后顺序扫描
+        keys = []
+        for item in records:
+            for key in (item["ts_code"], str(item["symbol"]).zfill(6), item["name"], pinyin_initials(item["name"])):
+                if key:
+                    keys.append((key.lower(), item["ts_code"]))
+        self._prefix_keys = sorted(set(keys))
+
+    @classmethod
+    def from_csv(cls, path: str = "data/stock_basic.csv"):
+        return cls(pd.read_csv(path, dtype={"symbol": str}))
+
+    def __contains__(self, order_book_id: str) -> bool:
+        return order_book_id in self._by_ts_code
+
+    def __len__(self) -> int:
+        return len(self.ts_codes)
+
+    def get(self, order_book_id: str) -> Optional[dict]:
+        """按ts_code（如000001.SZ）或symbol（如000001）查询"""
+        return self._by_ts_code.get(order_book_id) or self._by_symbol.get(order_book_id)
+
+    def search(self, prefix: str, limit: int = 20) -> List[dict]:
+        """按代码、名称或拼音首字母的前缀检索"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        result, seen = [], set()
+        idx = bisect_left(self._prefix_keys, (prefix, ""))
+        while idx < len(self._prefix_keys) and len(result) < limit:
+            key, ts_code = self._prefix_keys[idx]
+            if not key.startswith(prefix):
+                break
+            if ts_code not in seen:
+                seen.add(ts_code)
+                result.append(self._by_ts_code[ts_code])
+            idx += 1
+        return result
+
+
+@func.lru_cache(maxsize=1)
+def get_symbol_table() -> SymbolTable:
+    """进程内共享的股票代码表"""
+    return SymbolTable.from_csv()
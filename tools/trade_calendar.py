@@ -0,0 +1,84 @@
+from typing import Optional
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from cachetools import func
+
+CALENDAR_PATH = "data/stock_calender.csv"
+
+
+def to_int_date(value) -> int:
+    return int(pd.Timestamp(value).strftime("%Y%m%d"))
+
+
+def from_int_date(value: int) -> date:
+    return datetime.strptime(str(value), "%Y%m%d").date()
+
+
+class TradingCalendar:
+    """交易日历：交易日以YYYYMMDD的int32升序数组保存，所有查询都是searchsorted二分查找"""
+
+    def __init__(self, open_days: np.ndarray):
+        self.days = np.sort(np.asarray(open_days, dtype=np.int32))
+
+    @classmethod
+    def from_csv(cls, path: str = CALENDAR_PATH):
+        df = pd.read_csv(path)
+        return cls(df.loc[df["is_open"] == 1, "cal_date"].to_numpy())
+
+    @property
+    def first_day(self) -> date:
+        return from_int_date(self.days[0])
+
+    @property
+    def last_day(self) -> date:
+        return from_int_date(self.days[-1])
+
+    def is_open(self, day) -> bool:
+        value = to_int_date(day)
+        idx = np.searchsorted(self.days, value)
+        return idx < len(self.days) and self.days[idx] == value
+
+    def nearest_open_day(self, day) -> Optional[date]:
+        """不晚于day的最近交易日，早于日历起点时返回None"""
+        idx = np.searchsorted(self.days, to_int_date(day), side="right") - 1
+        if idx < 0:
+            return None
+        return from_int_date(self.days[idx])
+
+    def start_of_window(self, end_day, window: int) -> date:
+        """以end_day（含）往前数window个交易日的第一天"""
+        end_idx = np.searchsorted(self.days, to_int_date(end_day), side="right") - 1
+        start_idx = max(end_idx - window + 1, 0)
+        return from_int_date(self.days[start_idx])
+
+    def open_days_between(self, start_day, end_day) -> np.ndarray:
+        """[start_day, end_day]内的交易日数组"""
+        lo = np.searchsorted(self.days, to_int_date(start_day), side="left")
+        hi = np.searchsorted(self.days, to_int_date(end_day), side="right")
+        return self.days[lo:hi]
+
+    def count_between(self, start_day, end_day) -> int:
+        """[start_day, end_day]内的交易日数量"""
+        return len(self.open_days_between(start_day, end_day))
+
+    def index_of(self, day) -> int:
+        """day在交易日数组中的下标，非交易日返回之后第一个交易日的下标"""
+        return int(np.searchsorted(self.days, to_int_date(day), side="left"))
+
+
+@func.lru_cache(maxsize=1)
+def get_trading_calendar() -> TradingCalendar:
+    """进程内共享的交易日历"""
+    return TradingCalendar.from_csv()
+
+
+def extend_calendar(rows: pd.DataFrame, path: str = CALENDAR_PATH) -> TradingCalendar:
+    """把tushare trade_cal新查到的日期并入日历文件，并重新加载共享日历"""
+    df = pd.concat([pd.read_csv(path), rows]) if len(rows) else pd.read_csv(path)
+    df["cal_date"] = df["cal_date"].astype(int)
+    df = df.drop_duplicates(subset=["cal_date"], keep="last").sort_values("cal_date", ascending=False)
+    df.to_csv(path, index=False)
+    get_trading_calendar.cache_clear()
+    return get_trading_calendar()
@@ -0,0 +1,28 @@
+from typing import Optional
+
+import streamlit as st
+
+from tools.symbol_table import get_symbol_table
+
+SEARCH_LIMIT = 50  # 搜索结果最多列出的股票数
+
+
+def stock_selectbox(container=st, label: str = "请选择股票ID，支持手动输入", key: str = "stock_id") -> Optional[str]:
+    """股票选择框：先按代码、名称或拼音首字母前缀检索，再从结果里选择，返回ts_code"""
+    table = get_symbol_table()
+    query = container.text_input(
+        "搜索股票", placeholder="代码、名称或拼音首字母，如 000001、平安、payh", key=f"{key}_query"
+    ).strip()
+    if query:
+        options = [item["ts_code"] for item in table.search(query, limit=SEARCH_LIMIT)]
+        if not options:
+            container.caption("未找到匹配的股票")
+    else:
+        options = table.ts_codes
+    return container.selectbox(
+        label,
+        options=options,
+        index=0 if query and options else None,  # 有搜索词时默认选中最匹配的一只
+        format_func=lambda ts_code: f"{ts_code} {table.get(ts_code)['name']}",
+        key=f"{key}_{query}",  # 搜索词变化时换一个选择框，才会按index重新选中
+    )